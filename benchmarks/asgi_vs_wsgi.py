@@ -0,0 +1,124 @@
+"""
+Load test of the same read endpoints served by the WSGI app (gunicorn sync workers, the
+Procfile setup) and by the ASGI app (gunicorn + uvicorn workers with async sessions).
+
+    $ python benchmarks/asgi_vs_wsgi.py --workers 2 --concurrency 64 --duration 10
+
+Uses a fresh SQLite database unless --database-url points to a seeded one; the difference
+shows best on Postgres, where each request spends most of its time waiting on the network.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+SERVERS = {
+    "wsgi": ["gunicorn", "wsgi"],
+    "asgi": ["gunicorn", "asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+}
+PATHS = ["/people?limit=50", "/planets?limit=50", "/vehicles?limit=50", "/people/1", "/planets/1"]
+
+
+def seed(database_url, rows):
+    env = dict(os.environ, DATABASE_URL=database_url, CACHE_TTL="0")
+    code = (
+        "from sqlalchemy import insert\n"
+        "from app import app\n"
+        "from models import db, User, People, Planet, Vehicle\n"
+        "with app.app_context():\n"
+        "    db.create_all()\n"
+        "    db.session.execute(insert(User), [{'email': 'bench@swapi.dev', 'password': 'x'}])\n"
+        f"    db.session.execute(insert(People), [{{'name': f'p{{i}}', 'gender': 'n/a', 'user_id': 1}} for i in range({rows})])\n"
+        f"    db.session.execute(insert(Planet), [{{'name': f'p{{i}}', 'terrain': 't', 'climate': 'c'}} for i in range({rows})])\n"
+        f"    db.session.execute(insert(Vehicle), [{{'name': f'v{{i}}', 'model': 'm'}} for i in range({rows})])\n"
+        "    db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=SRC, env=env, check=True)
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/user", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def drive(base_url, concurrency, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(n):
+        i = n
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + PATHS[i % len(PATHS)], timeout=30).read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+            i += 1
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=3100)
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+        seed(database_url, args.rows)
+
+    # the response cache is disabled so both modes hit the database on every request
+    env = dict(os.environ, DATABASE_URL=database_url, CACHE_TTL="0")
+    results = {}
+    for mode, command in SERVERS.items():
+        bind = f"127.0.0.1:{args.port}"
+        server = subprocess.Popen(command + ["-w", str(args.workers), "-b", bind, "--log-level", "warning"],
+                                  cwd=SRC, env=env)
+        try:
+            wait_until_up("http://" + bind)
+            results[mode] = drive("http://" + bind, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Benchmark suite for every route of the API. Seeds a database at the requested scale
+(favorites follow a power law, a few popular people/planets get most of them), then
+drives each endpoint through the Flask test client or a real gunicorn server and
+reports throughput, p50/p95/p99 latency and memory per endpoint as JSON.
+
+    $ python benchmarks/harness.py --scale 10000 --output run.json
+    $ python benchmarks/harness.py --mode gunicorn --workers 4 --scale 100000 --output run.json
+    $ python benchmarks/harness.py --compare baseline.json run.json
+
+Without --database-url a fresh SQLite file is used. Against Postgres, point --database-url
+to an empty database that has been migrated with `pipenv run upgrade`.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+SEED_CHUNK = 10000
+
+
+def skewed_id(count, skew):
+    """1-based id where low ids are much more likely, P(id <= x) = (x / count) ** (1 / skew)."""
+    return int(count * random.random() ** skew) + 1
+
+
+def seed(app, scale, favorites, skew):
+    from sqlalchemy import insert
+    from bulk import insert_ignore, recount_favorites
+    from models import db, User, People, Planet, Vehicle, FavoritePeople, FavoritePlanet
+
+    def chunks(rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == SEED_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with app.app_context():
+        db.create_all()
+        tables = [
+            (User, ({"email": f"user{i}@swapi.dev", "password": "secret"} for i in range(scale))),
+            (People, ({"name": f"person-{i}", "gender": random.choice(("male", "female", "n/a")),
+                       "user_id": i + 1} for i in range(scale))),
+            (Planet, ({"name": f"planet-{i}", "terrain": random.choice(("desert", "ice", "forest", "ocean")),
+                       "climate": random.choice(("arid", "frozen", "temperate"))} for i in range(scale))),
+            (Vehicle, ({"name": f"vehicle-{i}", "model": f"model-{i % 100}"} for i in range(scale))),
+        ]
+        for model, rows in tables:
+            for chunk in chunks(rows):
+                db.session.execute(insert(model), chunk)
+        for model, column in ((FavoritePeople, "people_id"), (FavoritePlanet, "planet_id")):
+            rows = ({"user_id": skewed_id(scale, skew), column: skewed_id(scale, skew)} for _ in range(favorites))
+            for chunk in chunks(rows):
+                db.session.execute(insert_ignore(model, ["user_id", column]).values(chunk))
+            recount_favorites(model)
+        db.session.commit()
+
+
+def endpoints(scale):
+    """(name, method, path(i), json body(i)) for every route; i is the request number."""
+    hot = lambda i: skewed_id(scale, 3)
+    # writes that remove rows work on the top of the id range, away from the hot ids
+    doomed = lambda i: scale - i
+    return [
+        ("GET /", "GET", lambda i: "/", None),
+        ("GET /user", "GET", lambda i: "/user", None),
+        ("GET /health/db", "GET", lambda i: "/health/db", None),
+        ("GET /metrics", "GET", lambda i: "/metrics", None),
+        ("GET /users", "GET", lambda i: "/users?limit=100", None),
+        ("GET /users/<id>", "GET", lambda i: f"/users/{hot(i)}", None),
+        ("GET /users/<id>/favorites", "GET", lambda i: f"/users/{hot(i)}/favorites", None),
+        ("POST /users", "POST", lambda i: "/users", lambda i: {"email": f"bench{i}-{time.time_ns()}@swapi.dev", "password": "x"}),
+        # seeded passwords are plain text, the first login of each user also hashes it
+        ("POST /login", "POST", lambda i: "/login",
+         lambda i: {"email": f"user{scale // 2 + i % 100}@swapi.dev", "password": "secret"}),
+        ("PUT /users/<id>", "PUT", lambda i: f"/users/{hot(i)}", lambda i: {"password": f"changed-{i}"}),
+        ("GET /people", "GET", lambda i: "/people?limit=100", None),
+        ("GET /people filtered", "GET", lambda i: "/people?gender=female&name=person-1&order_by=name", None),
+        ("GET /people/top", "GET", lambda i: "/people/top", None),
+        ("GET /people/<id>", "GET", lambda i: f"/people/{hot(i)}", None),
+        ("GET /people?ids=", "GET", lambda i: "/people?ids=" + ",".join(str(hot(i) + j) for j in range(50)), None),
+        ("POST /people", "POST", lambda i: "/people", lambda i: {"name": f"bench-{i}-{time.time_ns()}", "gender": "n/a"}),
+        ("PUT /people/<id>", "PUT", lambda i: f"/people/{hot(i)}", lambda i: {"gender": "n/a"}),
+        ("POST /people/bulk", "POST", lambda i: "/people/bulk",
+         lambda i: [{"name": f"bulk-{i}-{j}-{time.time_ns()}", "gender": "n/a", "user_id": 1} for j in range(100)]),
+        ("PATCH /people/bulk", "PATCH", lambda i: "/people/bulk", lambda i: [{"id": hot(i) + j, "gender": "n/a"} for j in range(100)]),
+        ("GET /vehicles", "GET", lambda i: "/vehicles?limit=100", None),
+        ("GET /vehicles/<id>", "GET", lambda i: f"/vehicles/{hot(i)}", None),
+        ("POST /vehicles", "POST", lambda i: "/vehicles", lambda i: {"name": f"bench-{i}-{time.time_ns()}", "model": "x"}),
+        ("PUT /vehicles/<id>", "PUT", lambda i: f"/vehicles/{hot(i)}", lambda i: {"model": f"m-{i}"}),
+        ("POST /vehicles/bulk", "POST", lambda i: "/vehicles/bulk",
+         lambda i: [{"name": f"bulk-{i}-{j}-{time.time_ns()}", "model": "x"} for j in range(100)]),
+        ("GET /planets", "GET", lambda i: "/planets?limit=100", None),
+        ("GET /planets filtered", "GET", lambda i: "/planets?terrain=ice&climate=frozen", None),
+        ("GET /planets/top", "GET", lambda i: "/planets/top", None),
+        ("GET /planets/<id>", "GET", lambda i: f"/planets/{hot(i)}", None),
+        ("GET /planets?ids=", "GET", lambda i: "/planets?ids=" + ",".join(str(hot(i) + j) for j in range(50)), None),
+        ("POST /planets", "POST", lambda i: "/planets",
+         lambda i: {"name": f"bench-{i}-{time.time_ns()}", "terrain": "ice", "climate": "frozen"}),
+        ("PUT /planets/<id>", "PUT", lambda i: f"/planets/{hot(i)}", lambda i: {"climate": "arid"}),
+        ("PATCH /planets/bulk", "PATCH", lambda i: "/planets/bulk", lambda i: [{"id": hot(i) + j, "climate": "arid"} for j in range(100)]),
+        ("POST /favorite/planet/<id>", "POST", lambda i: f"/favorite/planet/{hot(i)}", lambda i: {"user_id": hot(i)}),
+        ("DELETE /favorite/planet/<id>", "DELETE", lambda i: f"/favorite/planet/{hot(i)}", lambda i: {"user_id": hot(i)}),
+        ("POST /favorite/people/<id>", "POST", lambda i: f"/favorite/people/{hot(i)}", lambda i: {"user_id": hot(i)}),
+        ("DELETE /favorite/people/<id>", "DELETE", lambda i: f"/favorite/people/{hot(i)}", lambda i: {"user_id": hot(i)}),
+        ("POST /favorite/bulk", "POST", lambda i: "/favorite/bulk",
+         lambda i: {"user_id": hot(i), "add": {"planets": [hot(j) for j in range(50)]}, "remove": {"people": [hot(j) for j in range(50)]}}),
+        ("DELETE /vehicles/bulk", "DELETE", lambda i: "/vehicles/bulk", lambda i: {"ids": [doomed(i) * 10 % scale + j + 1 for j in range(10)]}),
+        ("DELETE /planets/bulk", "DELETE", lambda i: "/planets/bulk", lambda i: {"ids": [doomed(i) * 10 % scale + j + 1 for j in range(10)]}),
+        ("DELETE /people/bulk", "DELETE", lambda i: "/people/bulk", lambda i: {"ids": [doomed(i) * 10 % scale + j + 1 for j in range(10)]}),
+        ("DELETE /vehicles/<id>", "DELETE", lambda i: f"/vehicles/{doomed(i)}", None),
+        ("DELETE /planets/<id>", "DELETE", lambda i: f"/planets/{doomed(i)}", None),
+        ("DELETE /people/<id>", "DELETE", lambda i: f"/people/{doomed(i)}", None),
+        ("DELETE /users/<id>", "DELETE", lambda i: f"/users/{doomed(i)}", None),
+    ]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def run_test_client(app, scale, requests):
+    client = app.test_client()
+    results = {}
+    for name, method, path, body in endpoints(scale):
+        latencies, errors = [], 0
+        tracemalloc.start()
+        started = time.perf_counter()
+        for i in range(requests):
+            start = time.perf_counter()
+            response = client.open(path(i), method=method, json=body(i) if body else None)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 500
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = summarize(latencies, errors, elapsed)
+        results[name]["peak_alloc_kb"] = round(peak / 1024, 1)
+    return results
+
+
+def rss_kb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                total += next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+        except (OSError, StopIteration):
+            pass
+    return total or None
+
+
+def server_pids(master_pid):
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as children:
+            return [master_pid] + [int(pid) for pid in children.read().split()]
+    except OSError:
+        return [master_pid]
+
+
+def run_gunicorn(database_url, scale, requests, workers, concurrency, port):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    bind = f"127.0.0.1:{port}"
+    server = subprocess.Popen(["gunicorn", "wsgi", "-w", str(workers), "-b", bind, "--log-level", "warning"],
+                              cwd=SRC, env=env)
+    base_url = "http://" + bind
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                urllib.request.urlopen(base_url + "/user", timeout=1)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+
+        results = {}
+        for name, method, path, body in endpoints(scale):
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+
+            def call(i):
+                data = json.dumps(body(i)).encode() if body else None
+                request = urllib.request.Request(base_url + path(i), data=data, method=method,
+                                                 headers={"Content-Type": "application/json"})
+                start = time.perf_counter()
+                try:
+                    urllib.request.urlopen(request, timeout=60).read()
+                except urllib.error.HTTPError as error:
+                    with lock:
+                        errors[0] += error.code >= 500
+                except OSError:
+                    with lock:
+                        errors[0] += 1
+                    return
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(call, range(requests)))
+            results[name] = summarize(latencies, errors[0], time.perf_counter() - started)
+            results[name]["server_rss_kb"] = rss_kb(server_pids(server.pid))
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(baseline_file, run_file, threshold):
+    with open(baseline_file) as f:
+        baseline = json.load(f)["endpoints"]
+    with open(run_file) as f:
+        run = json.load(f)["endpoints"]
+    report, regressions = {}, []
+    for name, result in run.items():
+        before = baseline.get(name)
+        if not before or not before.get("p95_ms") or not result.get("p95_ms"):
+            continue
+        ratio = result["p95_ms"] / before["p95_ms"]
+        report[name] = {"p95_before_ms": before["p95_ms"], "p95_after_ms": result["p95_ms"], "ratio": round(ratio, 2)}
+        if ratio > threshold:
+            regressions.append(name)
+    print(json.dumps({"endpoints": report, "regressions": regressions}, indent=2))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("client", "gunicorn"), default="client")
+    parser.add_argument("--database-url")
+    parser.add_argument("--scale", type=int, default=10000, help="rows per table (users, people, planets, vehicles)")
+    parser.add_argument("--favorites", type=int, help="favorites per kind, 5 per user by default")
+    parser.add_argument("--skew", type=float, default=3.0, help="higher means more favorites on the first ids")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=3200)
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RUN"))
+    parser.add_argument("--threshold", type=float, default=1.2, help="p95 ratio reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    random.seed(42)
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = database_url
+    if not args.cache:
+        os.environ["CACHE_TTL"] = "0"
+    sys.path.insert(0, SRC)
+    from app import app
+
+    started = time.perf_counter()
+    seed(app, args.scale, args.favorites or args.scale * 5, args.skew)
+    seed_seconds = time.perf_counter() - started
+
+    if args.mode == "client":
+        results = run_test_client(app, args.scale, args.requests)
+    else:
+        results = run_gunicorn(database_url, args.scale, args.requests, args.workers, args.concurrency, args.port)
+
+    report = {
+        "mode": args.mode,
+        "database": database_url.split("://")[0],
+        "scale": args.scale,
+        "requests_per_endpoint": args.requests,
+        "seed_seconds": round(seed_seconds, 2),
+        "endpoints": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
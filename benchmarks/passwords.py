@@ -0,0 +1,94 @@
+"""
+Login throughput at the configured hashing cost (PASSWORD_HASH_METHOD). Measures the raw
+hash time on one thread, then POST /login through the Flask app with increasing hashing
+pool sizes, and reports logins per second overall and per core.
+
+    $ python benchmarks/passwords.py --users 200 --concurrency 32 --duration 5
+    $ PASSWORD_HASH_METHOD=scrypt:16384:8:1 python benchmarks/passwords.py
+
+The per core number is the one to size workers with: a worker with PASSWORD_HASH_WORKERS=N
+can not log in more than about N times that many users per second.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def login_throughput(app, users, concurrency, duration):
+    done = []
+    deadline = time.perf_counter() + duration
+
+    def client_loop(n):
+        client = app.test_client()
+        count = 0
+        while time.perf_counter() < deadline:
+            i = (n + count * concurrency) % users
+            response = client.post("/login", json={"email": f"user{i}@swapi.dev", "password": f"secret-{i}"})
+            assert response.status_code == 200, response.status_code
+            count += 1
+        done.append(count)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client_loop, range(concurrency)))
+    return sum(done) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_file
+    os.environ["CACHE_TTL"] = "0"
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    from app import app
+    from credentials import PasswordHasher
+    from models import db, User
+
+    hasher = app.extensions["password_hasher"]
+    method = hasher.method
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        generate_password_hash("secret", method)
+    hash_seconds = (time.perf_counter() - start) / args.repeat
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [
+            {"email": f"user{i}@swapi.dev", "password": generate_password_hash(f"secret-{i}", method)}
+            for i in range(args.users)
+        ])
+        db.session.commit()
+
+    cores = os.cpu_count() or 1
+    results = {
+        "method": method,
+        "cores": cores,
+        "hash_ms": round(hash_seconds * 1000, 2),
+        "single_thread_hashes_per_s": round(1 / hash_seconds, 1),
+        "logins": {},
+    }
+    for workers in sorted({1, 2, cores, cores * 2}):
+        app.extensions["password_hasher"] = PasswordHasher(method, workers, queue=args.concurrency)
+        per_second = login_throughput(app, args.users, args.concurrency, args.duration)
+        results["logins"][f"{workers}_workers"] = {
+            "per_s": round(per_second, 1),
+            "per_s_per_core": round(per_second / min(workers, cores), 1),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
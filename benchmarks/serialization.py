@@ -0,0 +1,74 @@
+"""
+Compares the list serialization paths on a large payload:
+ORM objects + serialize() + stdlib json (the original path), result rows + stdlib json,
+and result rows + orjson (used by the API when orjson is installed).
+
+    $ python benchmarks/serialization.py --rows 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_file
+    from flask.json.provider import DefaultJSONProvider
+    from sqlalchemy import insert, select
+    from app import app
+    from models import db, Planet
+    from serializers import OrjsonProvider, orjson
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Planet), [
+            {"name": f"planet-{i}", "terrain": "desert", "climate": "arid"} for i in range(args.rows)
+        ])
+        db.session.commit()
+        columns = [getattr(Planet, name) for name in Planet.serialize_fields]
+        stdlib = DefaultJSONProvider(app)
+
+        def orm_stdlib():
+            planets = db.session.execute(select(Planet)).scalars().all()
+            stdlib.dumps([p.serialize() for p in planets])
+            db.session.expunge_all()
+
+        def rows_stdlib():
+            stdlib.dumps([row._asdict() for row in db.session.execute(select(*columns))])
+
+        results = {
+            "rows": args.rows,
+            "orm_serialize_stdlib_s": best_of(args.repeat, orm_stdlib),
+            "rows_stdlib_s": best_of(args.repeat, rows_stdlib),
+        }
+        if orjson is not None:
+            fast = OrjsonProvider(app)
+            results["rows_orjson_s"] = best_of(args.repeat, lambda: fast.dumps(
+                [row._asdict() for row in db.session.execute(select(*columns))]))
+        baseline = results["orm_serialize_stdlib_s"]
+        for key in [k for k in results if k.endswith("_s")]:
+            results[key[:-2] + "_speedup"] = round(baseline / results[key], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
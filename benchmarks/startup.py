@@ -0,0 +1,96 @@
+"""
+Cold start of a worker: time to import the app and latency of the first requests, each run
+in a fresh interpreter, for the development and production profiles (APP_PROFILE).
+
+    $ python benchmarks/startup.py --runs 10
+    $ python benchmarks/startup.py --gunicorn --runs 3
+
+--gunicorn also measures the time from starting gunicorn to its first successful response.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+PROFILES = ("development", "production")
+
+# runs in the fresh interpreter, prints one JSON line of timings in seconds
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from app import app, db
+imported = time.perf_counter()
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+timings = {"import_s": imported - start}
+for name, path in (("first_request_s", "/people?limit=1"), ("sitemap_s", "/"), ("admin_s", "/admin/")):
+    before = time.perf_counter()
+    client.get(path)
+    timings[name] = time.perf_counter() - before
+timings["modules"] = len(sys.modules)
+print(json.dumps(timings))
+"""
+
+
+def probe(env):
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=SRC, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def gunicorn_boot(env, port):
+    start = time.perf_counter()
+    server = subprocess.Popen(["gunicorn", "wsgi", "--bind", f"127.0.0.1:{port}", "--workers", "1"],
+                              cwd=SRC, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/people?limit=1", timeout=1).read()
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    raise RuntimeError("gunicorn exited")
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def median_ms(values):
+    return round(statistics.median(values) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--gunicorn", action="store_true")
+    parser.add_argument("--port", type=int, default=8079)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    results = {}
+    for profile in PROFILES:
+        env = dict(os.environ, DATABASE_URL="sqlite:///" + db_file, APP_PROFILE=profile)
+        runs = [probe(env) for _ in range(args.runs)]
+        results[profile] = {
+            "import_ms": median_ms([r["import_s"] for r in runs]),
+            "first_request_ms": median_ms([r["first_request_s"] for r in runs]),
+            "sitemap_ms": median_ms([r["sitemap_s"] for r in runs]),
+            "first_admin_request_ms": median_ms([r["admin_s"] for r in runs]),
+            "modules_loaded": runs[0]["modules"],
+        }
+        if args.gunicorn:
+            results[profile]["gunicorn_boot_ms"] = median_ms([gunicorn_boot(env, args.port) for _ in range(args.runs)])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
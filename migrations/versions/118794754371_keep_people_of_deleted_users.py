@@ -0,0 +1,36 @@
+"""keep people of deleted users
+
+Revision ID: 118794754371
+Revises: 32d0409fb624
+Create Date: 2026-10-18 08:22:26.963934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '118794754371'
+down_revision = '32d0409fb624'
+branch_labels = None
+depends_on = None
+
+# same constraint name as in 32d0409fb624 on both Postgres and SQLite
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def replace_user_foreign_key(ondelete, nullable):
+    with op.batch_alter_table('peoples', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.INTEGER(), nullable=nullable)
+        batch_op.drop_constraint('peoples_user_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('peoples_user_id_fkey', 'users', ['user_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    # people are catalog data, deleting their user only unlinks them
+    replace_user_foreign_key('SET NULL', nullable=True)
+
+
+def downgrade():
+    # fails while people of deleted users are left, link or delete them first
+    replace_user_foreign_key('CASCADE', nullable=False)
@@ -0,0 +1,47 @@
+"""cascade deletes
+
+Revision ID: 32d0409fb624
+Revises: a3146ca46eb4
+Create Date: 2026-10-18 07:42:47.481090
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '32d0409fb624'
+down_revision = 'a3146ca46eb4'
+branch_labels = None
+depends_on = None
+
+# The foreign keys were created unnamed. This is the name Postgres gave them, and the name
+# batch mode gives the reflected ones on SQLite, so the same directives work on both.
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+FOREIGN_KEYS = (
+    ('favorite_people', 'user_id', 'users'),
+    ('favorite_people', 'people_id', 'peoples'),
+    ('favorite_planet', 'user_id', 'users'),
+    ('favorite_planet', 'planet_id', 'planets'),
+    ('peoples', 'user_id', 'users'),
+)
+
+
+def replace_foreign_keys(ondelete):
+    for table in dict.fromkeys(table for table, _, _ in FOREIGN_KEYS):
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            for fk_table, column, referent in FOREIGN_KEYS:
+                if fk_table != table:
+                    continue
+                name = f'{table}_{column}_fkey'
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referent, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
@@ -1,16 +1,216 @@
+"""
+Admin panel. Every view is built from the model so that no page can scan a whole table:
+
+- page sizes are capped and deep pages stop at ADMIN_MAX_ROWS rows
+- totals come from the database statistics on big tables and are counted up to
+  ADMIN_MAX_ROWS rows when filtered
+- only indexed columns can be sorted or filtered on, there is no free text search
+- list pages show foreign key ids instead of loading relations, edit forms look up
+  related rows with an indexed prefix search instead of listing them all
+
+Writes keep the same invariants as the API: favorites can only be deleted here, and deleting
+them (or a user) goes through the helpers that maintain favorites_count. Every write drops
+the API's cached responses of the namespaces it touches.
+"""
 import os
+from flask import Flask
 from flask_admin import Admin
-from models import db, User
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from flask_admin.contrib.sqla.filters import FilterEqual
+from sqlalchemy import String, UniqueConstraint, func, inspect, select, text
+from sqlalchemy.orm import MANYTOONE
+from bulk import FAVORITE_TARGETS, adjust_favorite_counts, remove_favorites
+from cache import get_cache
+from credentials import hash_password
+from db_config import setup_database
+from models import db, User, People, Vehicle, Planet, FavoritePeople, FavoritePlanet
+from queries import prefix_range
+
+ADMIN_PAGE_SIZE = 50
+ADMIN_PAGE_SIZE_OPTIONS = (20, 50, 100)
+ADMIN_MAX_ROWS = 10000
+# a few people use the admin, it does not need the API's DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+ADMIN_POOL_SIZE = 2
+ADMIN_LOOKUP_SIZE = 10
+
+# response cache namespaces (see cache.py) that an admin write to the model can change
+CACHE_NAMESPACES = {
+    User: ("users", "people", "favorites"),
+    People: ("people", "users", "favorites"),
+    Vehicle: ("vehicles",),
+    Planet: ("planets", "favorites"),
+    FavoritePeople: ("favorites",),
+    FavoritePlanet: ("favorites",),
+}
+
+
+def indexed_columns(model):
+    """Columns that lead an index (or the primary key) and so can be sorted and filtered on."""
+    table = model.__table__
+    names = {column.name for column in table.primary_key}
+    for index in table.indexes:
+        ddl_if = getattr(index, "_ddl_if", None)
+        if ddl_if is None or ddl_if.dialect in (None, db.engine.dialect.name):
+            names.add(index.columns[0].name)
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.columns:
+            names.add(list(constraint.columns)[0].name)
+    return names
+
+
+def lookup_field(model):
+    """Column used to find rows of model from an edit form: the first indexed text column."""
+    indexed = indexed_columns(model)
+    for column in model.__table__.columns:
+        if column.name in indexed and isinstance(column.type, String):
+            return column.name
+    return None
+
+
+def estimated_count(session, model):
+    """Row count from the planner statistics, or the highest id where there are none."""
+    table = model.__table__.name
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        count = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                                {"table": table}).scalar()
+    elif dialect == "mysql":
+        count = session.execute(text("SELECT table_rows FROM information_schema.tables "
+                                     "WHERE table_schema = DATABASE() AND table_name = :table"),
+                                {"table": table}).scalar()
+    else:
+        # ids only grow, so this is an upper bound that drifts up with deletes
+        count = session.execute(select(func.max(model.id))).scalar()
+    # Postgres reports -1 for a table that was never analyzed
+    return count if count is not None and count >= 0 else None
+
+
+class PrefixAjaxModelLoader(QueryAjaxModelLoader):
+    """Looks related rows up by id or by the prefix of an indexed column, ADMIN_LOOKUP_SIZE at a time."""
+
+    def get_list(self, term, offset=0, limit=ADMIN_LOOKUP_SIZE):
+        query = self.get_query()
+        column = self._cached_fields[0]
+        if term.isdigit():
+            query = query.filter(getattr(self.model, self.pk) == int(term))
+        elif term:
+            query = query.filter(prefix_range(column, term))
+        return query.order_by(column).offset(offset).limit(min(limit, ADMIN_LOOKUP_SIZE)).all()
+
+
+class BoundedModelView(ModelView):
+    page_size = ADMIN_PAGE_SIZE
+    can_set_page_size = True
+    page_size_options = ADMIN_PAGE_SIZE_OPTIONS
+    # the count is computed in get_list, bounded, instead of a count(*) over the table
+    simple_list_pager = True
+    column_display_pk = True
+    column_default_sort = ("id", True)
+
+    def __init__(self, model, session, **kwargs):
+        mapper = inspect(model)
+        hidden = getattr(model, "hidden_fields", ())
+        indexed = indexed_columns(model)
+        self.column_list = [attr.key for attr in mapper.column_attrs if attr.key not in hidden]
+        self.column_sortable_list = [name for name in self.column_list if name in indexed]
+        self.column_filters = [FilterEqual(getattr(model, name), name) for name in self.column_sortable_list]
+        self.form_excluded_columns = list(getattr(model, "readonly_fields", ()))
+        self.form_ajax_refs = {}
+        for relationship in mapper.relationships:
+            target = relationship.mapper.class_
+            if relationship.direction is MANYTOONE and lookup_field(target):
+                self.form_ajax_refs[relationship.key] = PrefixAjaxModelLoader(
+                    relationship.key, session, target, fields=(lookup_field(target),))
+            else:
+                # collections would load every related row into a select box
+                self.form_excluded_columns.append(relationship.key)
+        super().__init__(model, session, **kwargs)
+
+    def on_model_change(self, form, model, is_created):
+        # edits made here must also invalidate the ETags handed out by the API
+        if not is_created and hasattr(model, "version"):
+            model.version = type(model).version + 1
+
+    def after_model_change(self, form, model, is_created):
+        self.invalidate_cache()
+
+    def after_model_delete(self, model):
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        cache = get_cache()
+        if cache is not None:
+            for namespace in CACHE_NAMESPACES.get(self.model, ()):
+                cache.invalidate(namespace)
+
+    def _get_list_extra_args(self):
+        view_args = super()._get_list_extra_args()
+        # anything but the offered sizes (negative ones included) gets the default
+        page_size = view_args.page_size if view_args.page_size in ADMIN_PAGE_SIZE_OPTIONS else self.page_size
+        max_page = ADMIN_MAX_ROWS // page_size - 1
+        return view_args.clone(page=max(0, min(view_args.page, max_page)), page_size=page_size)
+
+    def bounded_count(self, query):
+        rows = query.limit(None).offset(None).order_by(None).limit(ADMIN_MAX_ROWS).subquery()
+        return self.session.execute(select(func.count()).select_from(rows)).scalar()
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        _, query = super().get_list(page, sort_column, sort_desc, search, filters,
+                                    execute=False, page_size=page_size)
+        count = None
+        if not filters:
+            count = estimated_count(self.session, self.model)
+        if count is None or count < ADMIN_MAX_ROWS:
+            count = self.bounded_count(query)
+        return count, query.all() if execute else query
+
+
+class UserModelView(BoundedModelView):
+    def on_model_change(self, form, model, is_created):
+        super().on_model_change(form, model, is_created)
+        # the form shows the stored hash, anything typed over it is a new password
+        if form.password.data != form.password.object_data:
+            model.password = hash_password(form.password.data)
+
+
+    def on_model_delete(self, model):
+        # as DELETE /users/<id>: the favorites go through the helper so favorites_count stays right
+        remove_favorites(FavoritePeople, FavoritePeople.user_id == model.id)
+        remove_favorites(FavoritePlanet, FavoritePlanet.user_id == model.id)
+
+
+class FavoriteModelView(BoundedModelView):
+    # favorites are added through the API; removing one here keeps favorites_count in step
+    can_create = False
+    can_edit = False
+
+    def on_model_delete(self, model):
+        _, column = FAVORITE_TARGETS[self.model]
+        adjust_favorite_counts(self.model, [getattr(model, column)], -1)
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
-    # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    with app.app_context():
+        admin.add_view(UserModelView(User, db.session))
+        for model in (People, Vehicle, Planet):
+            admin.add_view(BoundedModelView(model, db.session))
+        for model in (FavoritePeople, FavoritePlanet):
+            admin.add_view(FavoriteModelView(model, db.session))
+
 
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+def create_admin_app(app):
+    """
+    The admin as its own Flask app next to the API, with its own small connection pool. The
+    API mounts it with utils.LazyMount, so flask_admin is imported on the first /admin request.
+    """
+    admin_app = Flask(app.import_name)
+    setup_database(admin_app, db, pool_size=ADMIN_POOL_SIZE, max_overflow=0)
+    admin_app.extensions["password_hasher"] = app.extensions["password_hasher"]
+    admin_app.extensions["response_cache"] = app.extensions["response_cache"]
+    setup_admin(admin_app)
+    return admin_app
@@ -1,30 +1,45 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
+
+APP_PROFILE=production leaves the admin out; otherwise it is built on the first /admin request.
 """
 import os
 from flask import Flask, request, jsonify
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from utils import APIException, LazyMount, generate_sitemap
+from cache import setup_cache, cached, invalidates
+from credentials import setup_credentials, hash_password, verify_password
+from serializers import setup_json
+from db_config import setup_database, setup_migrate, pool_status
+from dataset import setup_dataset
+from metrics import setup_metrics
+from replicas import setup_replicas
 from models import db, User, People, Vehicle, Planet, FavoritePeople, FavoritePlanet
-from sqlalchemy import select
+from bulk import add_favorites, bulk_create, bulk_update, bulk_delete, bulk_toggle_favorites, conditional_update, delete_entity, existing_targets, is_id, remove_favorites, user_exists
+from queries import FAVORITE_PEOPLE_LOADS, FAVORITE_PLANET_LOADS, USER_LOADS, etag_headers, get_many_response, most_favorited, paginate, page_response, parse_ids, stream_response, user_favorites_page, wants_stream
+from sqlalchemy import select, update
+
+PRODUCTION = os.environ.get("APP_PROFILE", "development") == "production"
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+setup_json(app)
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
+setup_database(app, db)
+setup_replicas(app)
+setup_migrate(app, db)
+setup_dataset(app)
+setup_metrics(app, db)
 CORS(app)
-setup_admin(app)
+setup_cache(app)
+setup_credentials(app)
+
+def admin_application():
+    from admin import create_admin_app
+    return create_admin_app(app)
+
+if not PRODUCTION:
+    app.wsgi_app = LazyMount(app.wsgi_app, "/admin", admin_application)
 
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
@@ -32,7 +47,14 @@ def handle_invalid_usage(error):
 
 @app.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(app, admin=not PRODUCTION)
+
+@app.route('/health/db', methods=['GET'])
+def database_health():
+    status = pool_status(db.engine)
+    if "replicas" in app.extensions:
+        status["replicas"] = app.extensions["replicas"].status()
+    return jsonify(status), 200
 
 @app.route('/user', methods=['GET'])
 def handle_hello():
@@ -45,60 +67,108 @@ if __name__ == '__main__':
 ####### USER #######
 @app.route("/users", methods=["GET"])
 def get_users():
-    users = db.session.execute(select(User)).scalars().all()
-    return jsonify([user.serialize() for user in users]), 200
+    ids = parse_ids(request.args)
+    if ids is not None:
+        return get_many_response(User, ids, USER_LOADS, namespaces=("users", "people")), 200
+    items, next_cursor = paginate(User, USER_LOADS)
+    return page_response(items, next_cursor), 200
 
 @app.route("/users/<int:user_id>", methods=["GET"])
 def get_user(user_id):
     user = db.session.execute(select(User).where(User.id == user_id)).scalar_one_or_none()
     if user is None:
         return jsonify({"error": "User not found"}), 404
-    return jsonify(user.serialize()), 200
+    payload = user.serialize()
+    return jsonify(payload), 200, etag_headers(user, payload)
+
+@app.route("/users/<int:user_id>/favorites", methods=["GET"])
+def get_user_favorites(user_id):
+    favorites, next_cursor = user_favorites_page(user_id)
+    if not favorites["people"] and not favorites["planets"] and not request.args.get("after"):
+        if db.session.get(User, user_id) is None:
+            return jsonify({"error": "User not found"}), 404
+    return page_response(favorites, next_cursor), 200
 
 @app.route("/users", methods=["POST"])
+@invalidates("users")
 def create_user():
     data = request.get_json()
-    if not data or "email" not in data or "password" not in data:
+    if not data or "email" not in data or not isinstance(data.get("password"), str):
         return jsonify({"error": "Missing data"}), 400
-    new_user = User(email=data["email"], password=data["password"])
+    new_user = User(email=data["email"], password=hash_password(data["password"]))
     db.session.add(new_user)
     db.session.commit()
-    return jsonify(new_user.serialize()), 201
+    payload = new_user.serialize()
+    return jsonify(payload), 201, etag_headers(new_user, payload)
 
-@app.route("/users/<int:id>", methods=["PUT"])
+@app.route("/users/<int:id>", methods=["PUT", "PATCH"])
+@invalidates("users")
 def update_user(id):
     data = request.get_json()
-    user = db.session.execute(select(User).where(User.id == id)).scalar_one_or_none()
-    if user is None:
+    if isinstance(data, dict) and isinstance(data.get("password"), str):
+        data = {**data, "password": hash_password(data["password"])}
+    updated = conditional_update(User, id, data, request.if_match)
+    if updated is None:
         return jsonify({"error": "User not found"}), 404
-    user.email = data.get("email", user.email)
-    user.password = data.get("password", user.password)
-    db.session.commit()
-    return jsonify(user.serialize()), 200
+    payload, headers = updated
+    return jsonify(payload), 200, headers
+
+@app.route("/login", methods=["POST"])
+def login():
+    data = request.get_json()
+    if not data or not isinstance(data.get("email"), str) or not isinstance(data.get("password"), str):
+        return jsonify({"error": "Missing data"}), 400
+    user = db.session.execute(select(User).where(User.email == data["email"]).options(*USER_LOADS)).scalar_one_or_none()
+    matches, new_hash = verify_password(user.password if user else None, data["password"])
+    if not matches:
+        return jsonify({"error": "Invalid email or password"}), 401
+    payload = user.serialize()
+    if new_hash:
+        # hashed with older settings (or not at all): upgrade it unless it was changed meanwhile
+        db.session.execute(update(User).where(User.id == user.id, User.password == user.password)
+                           .values(password=new_hash))
+        db.session.commit()
+    return jsonify(payload), 200
 
 @app.route("/users/<int:id>", methods=["DELETE"])
+@invalidates("users", "people", "favorites")
 def delete_user(id):
-    user = db.session.execute(select(User).where(User.id == id)).scalar_one_or_none()
-    if user is None:
+    # removed through the helpers so the favorites_count of people and planets stays right,
+    # the user's person stays in the catalog, ON DELETE SET NULL unlinks it
+    remove_favorites(FavoritePeople, FavoritePeople.user_id == id)
+    remove_favorites(FavoritePlanet, FavoritePlanet.user_id == id)
+    if not delete_entity(User, id):
         return jsonify({"error": "User not found"}), 404
-    db.session.delete(user)
-    db.session.commit()
     return jsonify({"message": "User deleted"}), 200
 
 ####### PEOPLE #######
 @app.route("/people", methods=["GET"])
+@cached("people")
 def get_people_list():
-    people = db.session.execute(select(People)).scalars().all()
-    return jsonify([p.serialize() for p in people]), 200
+    ids = parse_ids(request.args)
+    if ids is not None:
+        return get_many_response(People, ids, namespaces=("people",)), 200
+    if wants_stream():
+        return stream_response(People)
+    items, next_cursor = paginate(People)
+    return page_response(items, next_cursor), 200
+
+@app.route("/people/top", methods=["GET"])
+@cached("people", "favorites")
+def get_top_people():
+    return jsonify(most_favorited(People)), 200
 
 @app.route("/people/<int:people_id>", methods=["GET"])
+@cached("people")
 def get_people(people_id):
     person = db.session.execute(select(People).where(People.id == people_id)).scalar_one_or_none()
     if person is None:
         return jsonify({"error": "Person not found"}), 404
-    return jsonify(person.serialize()), 200
+    payload = person.serialize()
+    return jsonify(payload), 200, etag_headers(person, payload)
 
 @app.route("/people", methods=["POST"])
+@invalidates("people")
 def create_people():
     data = request.get_json()
     if not data or "name" not in data:
@@ -106,41 +176,66 @@ def create_people():
     new_person = People(name=data["name"])
     db.session.add(new_person)
     db.session.commit()
-    return jsonify(new_person.serialize()), 201
+    payload = new_person.serialize()
+    return jsonify(payload), 201, etag_headers(new_person, payload)
 
-@app.route("/people/<int:id>", methods=["PUT"])
+@app.route("/people/<int:id>", methods=["PUT", "PATCH"])
+@invalidates("people")
 def update_people(id):
-    data = request.get_json()
-    person = db.session.execute(select(People).where(People.id == id)).scalar_one_or_none()
-    if person is None:
+    updated = conditional_update(People, id, request.get_json(), request.if_match)
+    if updated is None:
         return jsonify({"error": "Person not found"}), 404
-    person.name = data.get("name", person.name)
-    db.session.commit()
-    return jsonify(person.serialize()), 200
+    payload, headers = updated
+    return jsonify(payload), 200, headers
 
 @app.route("/people/<int:id>", methods=["DELETE"])
+@invalidates("people")
 def delete_people(id):
-    person = db.session.execute(select(People).where(People.id == id)).scalar_one_or_none()
-    if person is None:
+    if not delete_entity(People, id):
         return jsonify({"error": "Person not found"}), 404
-    db.session.delete(person)
-    db.session.commit()
     return jsonify({"message": "Person deleted"}), 200
 
+@app.route("/people/bulk", methods=["POST"])
+@invalidates("people")
+def bulk_create_people():
+    payload, status = bulk_create(People, request.get_json())
+    return jsonify(payload), status
+
+@app.route("/people/bulk", methods=["PATCH"])
+@invalidates("people")
+def bulk_update_people():
+    payload, status = bulk_update(People, request.get_json())
+    return jsonify(payload), status
+
+@app.route("/people/bulk", methods=["DELETE"])
+@invalidates("people")
+def bulk_delete_people():
+    payload, status = bulk_delete(People, request.get_json())
+    return jsonify(payload), status
+
 ####### VEHICLE #######
 @app.route("/vehicles", methods=["GET"])
+@cached("vehicles")
 def get_vehicles():
-    vehicles = db.session.execute(select(Vehicle)).scalars().all()
-    return jsonify([v.serialize() for v in vehicles]), 200
+    ids = parse_ids(request.args)
+    if ids is not None:
+        return get_many_response(Vehicle, ids, namespaces=("vehicles",)), 200
+    if wants_stream():
+        return stream_response(Vehicle)
+    items, next_cursor = paginate(Vehicle)
+    return page_response(items, next_cursor), 200
 
 @app.route("/vehicles/<int:vehicle_id>", methods=["GET"])
+@cached("vehicles")
 def get_vehicle(vehicle_id):
     vehicle = db.session.execute(select(Vehicle).where(Vehicle.id == vehicle_id)).scalar_one_or_none()
     if vehicle is None:
         return jsonify({"error": "Vehicle not found"}), 404
-    return jsonify(vehicle.serialize()), 200
+    payload = vehicle.serialize()
+    return jsonify(payload), 200, etag_headers(vehicle, payload)
 
 @app.route("/vehicles", methods=["POST"])
+@invalidates("vehicles")
 def create_vehicle():
     data = request.get_json()
     if not data or "name" not in data or "model" not in data:
@@ -148,42 +243,71 @@ def create_vehicle():
     new_vehicle = Vehicle(name=data["name"], model=data["model"])
     db.session.add(new_vehicle)
     db.session.commit()
-    return jsonify(new_vehicle.serialize()), 201
+    payload = new_vehicle.serialize()
+    return jsonify(payload), 201, etag_headers(new_vehicle, payload)
 
-@app.route("/vehicles/<int:id>", methods=["PUT"])
+@app.route("/vehicles/<int:id>", methods=["PUT", "PATCH"])
+@invalidates("vehicles")
 def update_vehicle(id):
-    data = request.get_json()
-    vehicle = db.session.execute(select(Vehicle).where(Vehicle.id == id)).scalar_one_or_none()
-    if vehicle is None:
+    updated = conditional_update(Vehicle, id, request.get_json(), request.if_match)
+    if updated is None:
         return jsonify({"error": "Vehicle not found"}), 404
-    vehicle.name = data.get("name", vehicle.name)
-    vehicle.model = data.get("model", vehicle.model)
-    db.session.commit()
-    return jsonify(vehicle.serialize()), 200
+    payload, headers = updated
+    return jsonify(payload), 200, headers
 
 @app.route("/vehicles/<int:id>", methods=["DELETE"])
+@invalidates("vehicles")
 def delete_vehicle(id):
-    vehicle = db.session.execute(select(Vehicle).where(Vehicle.id == id)).scalar_one_or_none()
-    if vehicle is None:
+    if not delete_entity(Vehicle, id):
         return jsonify({"error": "Vehicle not found"}), 404
-    db.session.delete(vehicle)
-    db.session.commit()
     return jsonify({"message": "Vehicle deleted"}), 200
 
+@app.route("/vehicles/bulk", methods=["POST"])
+@invalidates("vehicles")
+def bulk_create_vehicles():
+    payload, status = bulk_create(Vehicle, request.get_json())
+    return jsonify(payload), status
+
+@app.route("/vehicles/bulk", methods=["PATCH"])
+@invalidates("vehicles")
+def bulk_update_vehicles():
+    payload, status = bulk_update(Vehicle, request.get_json())
+    return jsonify(payload), status
+
+@app.route("/vehicles/bulk", methods=["DELETE"])
+@invalidates("vehicles")
+def bulk_delete_vehicles():
+    payload, status = bulk_delete(Vehicle, request.get_json())
+    return jsonify(payload), status
+
 ####### PLANET #######
 @app.route("/planets", methods=["GET"])
+@cached("planets")
 def get_planets():
-    planets = db.session.execute(select(Planet)).scalars().all()
-    return jsonify([planet.serialize() for planet in planets]), 200
+    ids = parse_ids(request.args)
+    if ids is not None:
+        return get_many_response(Planet, ids, namespaces=("planets",)), 200
+    if wants_stream():
+        return stream_response(Planet)
+    items, next_cursor = paginate(Planet)
+    return page_response(items, next_cursor), 200
+
+@app.route("/planets/top", methods=["GET"])
+@cached("planets", "favorites")
+def get_top_planets():
+    return jsonify(most_favorited(Planet)), 200
 
 @app.route("/planets/<int:planet_id>", methods=["GET"])
+@cached("planets")
 def get_planet(planet_id):
     planet = db.session.execute(select(Planet).where(Planet.id == planet_id)).scalar_one_or_none()
     if planet is None:
         return jsonify({"error": "Planet not found"}), 404
-    return jsonify(planet.serialize()), 200
+    payload = planet.serialize()
+    return jsonify(payload), 200, etag_headers(planet, payload)
 
 @app.route("/planets", methods=["POST"])
+@invalidates("planets")
 def create_planet():
     data = request.get_json()
     if not data or "name" not in data or "model" not in data:
@@ -191,66 +315,107 @@ def create_planet():
     new_planet = Planet(name=data["name"], model=data["model"])
     db.session.add(new_planet)
     db.session.commit()
-    return jsonify(new_planet.serialize()), 201
+    payload = new_planet.serialize()
+    return jsonify(payload), 201, etag_headers(new_planet, payload)
 
-@app.route("/planets/<int:id>", methods=["PUT"])
+@app.route("/planets/<int:id>", methods=["PUT", "PATCH"])
+@invalidates("planets")
 def update_planet(id):
-    data = request.get_json()
-    planet = db.session.execute(select(Planet).where(Planet.id == id)).scalar_one_or_none()
-    if planet is None:
+    updated = conditional_update(Planet, id, request.get_json(), request.if_match)
+    if updated is None:
         return jsonify({"error": "Planet not found"}), 404
-    planet.name = data.get("name", planet.name)
-    planet.model = data.get("model", planet.model)
-    db.session.commit()
-    return jsonify(planet.serialize()), 200
+    payload, headers = updated
+    return jsonify(payload), 200, headers
 
 @app.route("/planets/<int:id>", methods=["DELETE"])
+@invalidates("planets")
 def delete_planet(id):
-    planet = db.session.execute(select(Planet).where(Planet.id == id)).scalar_one_or_none()
-    if planet is None:
+    if not delete_entity(Planet, id):
         return jsonify({"error": "Planet not found"}), 404
-    db.session.delete(planet)
-    db.session.commit()
     return jsonify({"message": "Planet deleted"}), 200
 
+@app.route("/planets/bulk", methods=["POST"])
+@invalidates("planets")
+def bulk_create_planets():
+    payload, status = bulk_create(Planet, request.get_json())
+    return jsonify(payload), status
+
+@app.route("/planets/bulk", methods=["PATCH"])
+@invalidates("planets")
+def bulk_update_planets():
+    payload, status = bulk_update(Planet, request.get_json())
+    return jsonify(payload), status
+
+@app.route("/planets/bulk", methods=["DELETE"])
+@invalidates("planets")
+def bulk_delete_planets():
+    payload, status = bulk_delete(Planet, request.get_json())
+    return jsonify(payload), status
+
 ####### FAVORITE PLANET #######
 @app.route("/favorite/planet/<int:planet_id>", methods=["POST"])
+@invalidates("favorites")
 def add_favorite_planet(planet_id):
     user_id = request.json.get("user_id")
-    if not user_id:
+    if not is_id(user_id):
         return jsonify({"error": "user_id is required"}), 400
-    new_fav = FavoritePlanet(user_id=user_id, planet_id=planet_id)
-    db.session.add(new_fav)
+    if not user_exists(user_id):
+        return jsonify({"error": "User not found"}), 404
+    if not existing_targets(FavoritePlanet, [planet_id])[0]:
+        return jsonify({"error": "Planet not found"}), 404
+    created = add_favorites(FavoritePlanet, user_id, [planet_id])
     db.session.commit()
-    return jsonify(new_fav.serialize()), 201
+    fav = db.session.execute(
+        select(FavoritePlanet).options(*FAVORITE_PLANET_LOADS)
+        .where(FavoritePlanet.user_id == user_id, FavoritePlanet.planet_id == planet_id)
+    ).scalar_one()
+    return jsonify(fav.serialize()), 201 if created else 200
 
 @app.route("/favorite/planet/<int:planet_id>", methods=["DELETE"])
+@invalidates("favorites")
 def delete_favorite_planet(planet_id):
     user_id = request.json.get("user_id")
-    fav = FavoritePlanet.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-    if not fav:
+    if not is_id(user_id):
+        return jsonify({"error": "user_id is required"}), 400
+    removed = remove_favorites(FavoritePlanet, FavoritePlanet.user_id == user_id, FavoritePlanet.planet_id == planet_id)
+    if not removed:
         return jsonify({"error": "Favorite not found"}), 404
-    db.session.delete(fav)
     db.session.commit()
     return jsonify({"message": "Favorite deleted"}), 204
 
 ####### FAVORITE PEOPLE #######
 @app.route("/favorite/people/<int:people_id>", methods=["POST"])
+@invalidates("favorites")
 def add_favorite_people(people_id):
     user_id = request.json.get("user_id")
-    if not user_id:
+    if not is_id(user_id):
         return jsonify({"error": "user_id is required"}), 400
-    new_fav = FavoritePeople(user_id=user_id, people_id=people_id)
-    db.session.add(new_fav)
+    if not user_exists(user_id):
+        return jsonify({"error": "User not found"}), 404
+    if not existing_targets(FavoritePeople, [people_id])[0]:
+        return jsonify({"error": "Person not found"}), 404
+    created = add_favorites(FavoritePeople, user_id, [people_id])
     db.session.commit()
-    return jsonify(new_fav.serialize()), 201
+    fav = db.session.execute(
+        select(FavoritePeople).options(*FAVORITE_PEOPLE_LOADS)
+        .where(FavoritePeople.user_id == user_id, FavoritePeople.people_id == people_id)
+    ).scalar_one()
+    return jsonify(fav.serialize()), 201 if created else 200
 
 @app.route("/favorite/people/<int:people_id>", methods=["DELETE"])
+@invalidates("favorites")
 def delete_favorite_people(people_id):
     user_id = request.json.get("user_id")
-    fav = FavoritePeople.query.filter_by(user_id=user_id, people_id=people_id).first()
-    if not fav:
+    if not is_id(user_id):
+        return jsonify({"error": "user_id is required"}), 400
+    removed = remove_favorites(FavoritePeople, FavoritePeople.user_id == user_id, FavoritePeople.people_id == people_id)
+    if not removed:
         return jsonify({"error": "Favorite not found"}), 404
-    db.session.delete(fav)
     db.session.commit()
-    return jsonify({"message": "Favorite deleted"}), 204
\ No newline at end of file
+    return jsonify({"message": "Favorite deleted"}), 204
+
+####### FAVORITES (BATCH) #######
+@app.route("/favorite/bulk", methods=["POST"])
+@invalidates("favorites")
+def bulk_favorites():
+    return jsonify(bulk_toggle_favorites(request.get_json())), 200
@@ -0,0 +1,117 @@
+"""
+Alternative ASGI entry point. The catalog reads (GET /users, /people, /vehicles, /planets and
+their /<id> variants, the bulk of the traffic) run as async handlers on an async SQLAlchemy
+engine, so one worker overlaps many DB round trips. Every other request, NDJSON exports and
+multi-gets (?ids=) are handed to the Flask app unchanged.
+
+    $ gunicorn asgi:application -k uvicorn.workers.UvicornWorker --chdir ./src/
+
+Needs uvicorn and asgiref, plus asyncpg (Postgres) or aiosqlite (SQLite). The async reads
+reuse the statements built in queries.py, so filters, cursors and errors behave the same;
+they are not served from the response cache. With DATABASE_REPLICA_URLS they read from the
+replicas, with the same stickiness and failover as the Flask app (see replicas.py).
+"""
+import hashlib
+import os
+import re
+from asgiref.wsgi import WsgiToAsgi
+from flask import request
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app import app
+from db_config import async_engine_options
+from models import User, People, Vehicle, Planet
+from queries import USER_LOADS, etag_headers, page_query, read_page, wants_stream
+from replicas import ReplicaSet, reads_primary, replica_urls
+from utils import APIException
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+READ_ROUTES = {
+    "users": (User, USER_LOADS, "User not found"),
+    "people": (People, (), "Person not found"),
+    "vehicles": (Vehicle, (), "Vehicle not found"),
+    "planets": (Planet, (), "Planet not found"),
+}
+READ_ROUTE = re.compile(r"^/(users|people|vehicles|planets)(?:/(\d+))?/?$")
+
+
+def async_database_url(url):
+    scheme, _, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + "://" + rest
+
+
+engine = create_async_engine(async_database_url(app.config["SQLALCHEMY_DATABASE_URI"]),
+                             **async_engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+replicas = ReplicaSet([create_async_engine(async_database_url(url), **async_engine_options(url))
+                       for url in replica_urls()], float(os.environ.get("REPLICA_RETRY_SECONDS", 30)))
+flask_application = WsgiToAsgi(app)
+
+
+async def read(model, options, not_found, item_id):
+    """Returns (status, payload, extra headers) for a collection page or a single entity."""
+    replica = None if reads_primary() else replicas.pick()
+    if replica is not None:
+        try:
+            return await read_from(async_sessionmaker(replica.engine, expire_on_commit=False),
+                                   model, options, not_found, item_id)
+        except DBAPIError:
+            if replica.up:
+                raise
+            # the replica just became unreachable, fall back to the primary
+    return await read_from(Session, model, options, not_found, item_id)
+
+
+async def read_from(session_factory, model, options, not_found, item_id):
+    async with session_factory() as session:
+        if item_id is None:
+            stmt, orm, limit = page_query(model, options)
+            items, next_cursor = read_page(model, await session.execute(stmt), orm, limit)
+            return 200, items, {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        entity = await session.get(model, item_id, options=options)
+        if entity is None:
+            return 404, {"error": not_found}, {}
+        payload = entity.serialize()
+        return 200, payload, etag_headers(entity, payload)
+
+
+async def send_json(send, status, body, headers):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def application(scope, receive, send):
+    match = READ_ROUTE.match(scope.get("path", "")) if scope["type"] == "http" and scope["method"] == "GET" else None
+    if match is None:
+        return await flask_application(scope, receive, send)
+
+    model, options, not_found = READ_ROUTES[match.group(1)]
+    item_id = int(match.group(2)) if match.group(2) else None
+    request_headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+    query_string = scope["query_string"].decode("latin-1")
+    with app.test_request_context(scope["path"], query_string=query_string, headers=request_headers):
+        # streamed exports and multi-gets (?ids=, which go through the identity cache) are Flask's
+        handoff = wants_stream() or (item_id is None and "ids" in request.args)
+        if not handoff:
+            try:
+                status, payload, headers = await read(model, options, not_found, item_id)
+            except APIException as error:
+                status, payload, headers = error.status_code, error.to_dict(), {}
+            body = (app.json.dumps(payload) + "\n").encode()
+    if handoff:
+        return await flask_application(scope, receive, send)
+
+    headers["Content-Type"] = "application/json"
+    headers["Access-Control-Allow-Origin"] = "*"
+    if status == 200:
+        # single entities carry their version, pages a hash of the body
+        headers.setdefault("ETag", '"' + hashlib.sha1(body).hexdigest() + '"')
+        if request_headers.get("if-none-match") == headers["ETag"]:
+            return await send_json(send, 304, b"", headers)
+    headers["Content-Length"] = str(len(body))
+    await send_json(send, status, body, headers)
@@ -0,0 +1,428 @@
+"""
+Batch writes for the catalog models. Every batch is validated up front (one IN query per
+unique column), then written with a single executemany statement inside one transaction.
+Items that fail validation are reported by their index and the rest of the batch is applied.
+"""
+from collections import Counter, defaultdict
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from models import db, User, People, Planet, FavoritePeople, FavoritePlanet
+from queries import etag_headers
+from utils import APIException
+
+MAX_BATCH_SIZE = 5000
+
+
+def is_id(value):
+    # bool is an int subclass, true must not stand for id 1
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def writable_columns(model):
+    readonly = getattr(model, "readonly_fields", ())
+    return {c.key: c for c in model.__table__.columns if not c.primary_key and c.key not in readonly}
+
+
+def required_columns(model):
+    return [key for key, c in writable_columns(model).items()
+            if not c.nullable and c.default is None and c.server_default is None]
+
+
+def parse_batch(data, key="items"):
+    """Accepts either a bare JSON list or an object wrapping the list under `key`."""
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list) or not data:
+        raise APIException(f"Expected a non empty list of {key}", status_code=400)
+    if len(data) > MAX_BATCH_SIZE:
+        raise APIException(f"A batch can have at most {MAX_BATCH_SIZE} {key}", status_code=400)
+    return data
+
+
+def validate_values(model, item, partial=False):
+    if not isinstance(item, dict):
+        return "Expected an object"
+    columns = writable_columns(model)
+    values = {k: v for k, v in item.items() if k != "id"}
+    unknown = [k for k in values if k not in columns]
+    if unknown:
+        return "Unknown fields: " + ", ".join(unknown)
+    if not partial:
+        missing = [k for k in required_columns(model) if values.get(k) is None]
+        if missing:
+            return "Missing fields: " + ", ".join(missing)
+    for k, v in values.items():
+        if v is None and not columns[k].nullable:
+            return f"{k} can not be null"
+        python_type = columns[k].type.python_type
+        # bool is an int subclass, JSON true is not a number
+        if v is not None and (not isinstance(v, python_type) or (isinstance(v, bool) and python_type is not bool)):
+            return f"{k} has the wrong type"
+    return None
+
+
+def unique_conflicts(model, candidates):
+    """
+    candidates: {index: (id or None, values)}. Returns {index: error} for values that
+    collide with other rows of the table or with an earlier item of the same batch.
+    """
+    errors = {}
+    for key, column in writable_columns(model).items():
+        if not column.unique:
+            continue
+        wanted = {values[key] for _, values in candidates.values() if values.get(key) is not None}
+        if not wanted:
+            continue
+        taken = dict(db.session.execute(
+            select(getattr(model, key), model.id).where(getattr(model, key).in_(wanted))
+        ).all())
+        seen = {}
+        for index, (row_id, values) in candidates.items():
+            value = values.get(key)
+            if value is None or index in errors:
+                continue
+            if (value in taken and taken[value] != row_id) or value in seen:
+                errors[index] = f"{key} '{value}' already exists"
+            else:
+                seen[value] = index
+    return errors
+
+
+def missing_references(model, candidates):
+    """
+    candidates as for unique_conflicts. Returns {index: error} for foreign keys pointing to
+    rows that do not exist, with one IN query per foreign key column.
+    """
+    errors = {}
+    for key, column in writable_columns(model).items():
+        for foreign_key in column.foreign_keys:
+            wanted = {values[key] for _, values in candidates.values() if values.get(key) is not None}
+            if not wanted:
+                continue
+            target = foreign_key.column
+            found = set(db.session.execute(select(target).where(target.in_(wanted))).scalars())
+            for index, (_, values) in candidates.items():
+                value = values.get(key)
+                if value is not None and value not in found and index not in errors:
+                    errors[index] = f"{key} {value} does not exist"
+    return errors
+
+
+def rollback_conflict():
+    # validated up front, so only a row written meanwhile by another request gets here
+    db.session.rollback()
+    raise APIException("The batch conflicts with an existing row, nothing was written", status_code=409)
+
+
+def batch_result(written, errors, success_status):
+    """
+    The response of a batch: written has one item per row written, tagged with its index in
+    the request like the errors. A batch with errors is a 207 as soon as a row was written.
+    """
+    payload = {"items": written, "errors": [{"index": i, "error": e} for i, e in sorted(errors.items())]}
+    if not errors:
+        return payload, success_status
+    return payload, 207 if len(written) > 0 else 400
+
+
+def bulk_create(model, data):
+    items = parse_batch(data)
+    errors, candidates = {}, {}
+    for index, item in enumerate(items):
+        error = validate_values(model, item)
+        if error:
+            errors[index] = error
+        else:
+            candidates[index] = (None, {k: v for k, v in item.items() if k != "id"})
+    errors.update(unique_conflicts(model, candidates))
+    errors.update(missing_references(model, {i: c for i, c in candidates.items() if i not in errors}))
+    indexes = [index for index in candidates if index not in errors]
+    rows = [candidates[index][1] for index in indexes]
+
+    created = []
+    if rows:
+        try:
+            if db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+                stmt = insert(model).returning(model, sort_by_parameter_order=True)
+                created = [{"index": index, **obj.serialize()}
+                           for index, obj in zip(indexes, db.session.execute(stmt, rows).scalars())]
+            else:
+                # no RETURNING in parameter order, the rows are reported without their ids
+                db.session.execute(insert(model), rows)
+                created = [{"index": index} for index in indexes]
+            db.session.commit()
+        except IntegrityError:
+            rollback_conflict()
+    return batch_result(created, errors, 201)
+
+
+def update_rows(model, rows):
+    """
+    Updates rows by id and bumps their version, with one executemany per set of columns:
+    an UPDATE with its own SET clause (like the version bump) is not batched by the ORM.
+    """
+    table = model.__table__
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(sorted(key for key in row if key != "id"))].append(row)
+    for columns, group in groups.items():
+        stmt = (update(table).where(table.c.id == bindparam("b_id"))
+                .values(**{column: bindparam(f"b_{column}") for column in columns}, version=table.c.version + 1))
+        db.session.execute(stmt, [{"b_id": row["id"], **{f"b_{column}": row[column] for column in columns}}
+                                  for row in group])
+
+
+def bulk_update(model, data):
+    items = parse_batch(data)
+    errors, candidates = {}, {}
+    for index, item in enumerate(items):
+        error = validate_values(model, item, partial=True)
+        if error is None and not is_id(item.get("id")):
+            error = "Missing id"
+        if error:
+            errors[index] = error
+        else:
+            candidates[index] = (item["id"], {k: v for k, v in item.items() if k != "id"})
+
+    ids = {row_id for row_id, _ in candidates.values()}
+    existing = set(db.session.execute(select(model.id).where(model.id.in_(ids))).scalars()) if ids else set()
+    for index, (row_id, _) in candidates.items():
+        if row_id not in existing:
+            errors[index] = f"id {row_id} not found"
+    errors.update(unique_conflicts(model, {i: c for i, c in candidates.items() if i not in errors}))
+    errors.update(missing_references(model, {i: c for i, c in candidates.items() if i not in errors}))
+
+    indexes = [index for index in candidates if index not in errors]
+    rows = [{"id": candidates[index][0], **candidates[index][1]} for index in indexes]
+    if rows:
+        try:
+            update_rows(model, rows)
+            db.session.commit()
+        except IntegrityError:
+            rollback_conflict()
+    return batch_result([{"index": index, "id": row["id"]} for index, row in zip(indexes, rows)], errors, 200)
+
+
+def matched_versions(if_match):
+    """Versions allowed by an If-Match header, None when any version is (no header or *)."""
+    if not if_match or if_match.star_tag:
+        return None
+    # the version is the part of the ETag before any content hash, see queries.etag_headers
+    versions = [tag.split("-", 1)[0] for tag in if_match.as_set()]
+    return [int(version) for version in versions if version.isdigit()]
+
+
+def conditional_update(model, entity_id, data, if_match=None):
+    """
+    Partial update of one entity in a single UPDATE ... WHERE id = ? AND version IN (...)
+    RETURNING statement, which also bumps the version. Returns (payload, ETag headers), or
+    None when there is no such entity. A version that does not match If-Match is a 412; only
+    failed updates cost a second query, to tell the two apart.
+    """
+    error = validate_values(model, data, partial=True)
+    if error:
+        raise APIException(error, status_code=400)
+    values = {k: v for k, v in data.items() if k != "id"}
+    stmt = update(model).where(model.id == entity_id).values(**values, version=model.version + 1)
+    versions = matched_versions(if_match)
+    if versions is not None:
+        stmt = stmt.where(model.version.in_(versions))
+    try:
+        if db.engine.dialect.update_returning:
+            entity = db.session.execute(stmt.returning(model)).scalar_one_or_none()
+        else:
+            updated = db.session.execute(stmt).rowcount
+            entity = db.session.get(model, entity_id, populate_existing=True) if updated else None
+    except IntegrityError:
+        # a unique value taken by another row, or a reference to a missing one
+        db.session.rollback()
+        raise APIException("Conflicts with an existing row", status_code=409)
+
+    if entity is None:
+        db.session.rollback()
+        current = db.session.execute(select(model.version).where(model.id == entity_id)).scalar_one_or_none()
+        if current is None:
+            return None
+        raise APIException("The entity was modified, fetch it again", status_code=412,
+                           payload={"version": current})
+    # serialized before the commit expires the instance, which would cost a reload
+    payload = entity.serialize()
+    headers = etag_headers(entity, payload)
+    db.session.commit()
+    return payload, headers
+
+
+def delete_entity(model, entity_id):
+    """
+    Deletes one row with a single DELETE ... RETURNING, without loading it. Dependent rows are
+    removed by ON DELETE CASCADE in the database. Returns False when there was no such row.
+    """
+    stmt = delete(model).where(model.id == entity_id)
+    if db.engine.dialect.delete_returning:
+        deleted = db.session.execute(stmt.returning(model.id)).first() is not None
+    else:
+        deleted = db.session.execute(stmt).rowcount > 0
+    db.session.commit()
+    return deleted
+
+
+def bulk_delete(model, data):
+    items = parse_batch(data, key="ids")
+    errors, ids = {}, {}
+    for index, row_id in enumerate(items):
+        if not is_id(row_id):
+            errors[index] = "Expected an integer id"
+        else:
+            ids.setdefault(row_id, index)
+
+    deleted = set()
+    if ids:
+        # dependent rows (favorites) go with them through ON DELETE CASCADE
+        stmt = delete(model).where(model.id.in_(ids))
+        if db.engine.dialect.delete_returning:
+            deleted = set(db.session.execute(stmt.returning(model.id)).scalars())
+        else:
+            deleted = set(db.session.execute(select(model.id).where(model.id.in_(ids))).scalars())
+            db.session.execute(stmt)
+        db.session.commit()
+    for row_id, index in ids.items():
+        if row_id not in deleted:
+            errors[index] = f"id {row_id} not found"
+    return batch_result([{"index": index, "id": row_id} for row_id, index in ids.items() if row_id in deleted],
+                        errors, 200)
+
+
+def insert_ignore(model, conflict_columns):
+    """INSERT that silently skips rows hitting the unique constraint on conflict_columns."""
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model.__table__).on_conflict_do_nothing(index_elements=conflict_columns)
+    if dialect == "sqlite":
+        return sqlite.insert(model.__table__).on_conflict_do_nothing(index_elements=conflict_columns)
+    return insert(model.__table__).prefix_with("IGNORE")
+
+
+FAVORITE_KINDS = {"people": FavoritePeople, "planets": FavoritePlanet}
+
+# favorite model -> (favorited model, foreign key column) whose favorites_count it maintains
+FAVORITE_TARGETS = {
+    FavoritePeople: (People, "people_id"),
+    FavoritePlanet: (Planet, "planet_id"),
+}
+
+
+def recount_statement(favorite_model, ids=None):
+    """The UPDATE recomputing favorites_count from the favorite rows, for ids or the whole table."""
+    entity, column = FAVORITE_TARGETS[favorite_model]
+    count = select(func.count()).where(getattr(favorite_model, column) == entity.id).scalar_subquery()
+    stmt = update(entity.__table__).values(favorites_count=count)
+    if ids is not None:
+        stmt = stmt.where(entity.id.in_(ids))
+    return stmt
+
+
+def recount_favorites(favorite_model, ids=None):
+    db.session.execute(recount_statement(favorite_model, ids))
+
+
+def adjust_favorite_counts(favorite_model, entity_ids, delta):
+    """Moves favorites_count by delta once per id in entity_ids, as a single executemany."""
+    entity, _ = FAVORITE_TARGETS[favorite_model]
+    table = entity.__table__
+    stmt = (update(table).where(table.c.id == bindparam("b_id"))
+            .values(favorites_count=table.c.favorites_count + bindparam("b_delta")))
+    changes = [{"b_id": entity_id, "b_delta": n * delta} for entity_id, n in Counter(entity_ids).items()]
+    if changes:
+        db.session.execute(stmt, changes)
+
+
+def user_exists(user_id):
+    return db.session.execute(select(User.id).where(User.id == user_id)).scalar() is not None
+
+
+def require_user(user_id):
+    if not user_exists(user_id):
+        raise APIException("User not found", status_code=404)
+
+
+def existing_targets(favorite_model, ids):
+    """Splits ids into those of existing people/planets and the missing ones, with one IN query."""
+    entity, _ = FAVORITE_TARGETS[favorite_model]
+    found = set(db.session.execute(select(entity.id).where(entity.id.in_(ids))).scalars())
+    return [i for i in ids if i in found], [i for i in ids if i not in found]
+
+
+def add_favorites(favorite_model, user_id, ids):
+    """Inserts the missing favorites of a user and returns the ids that were actually added."""
+    _, column = FAVORITE_TARGETS[favorite_model]
+    stmt = insert_ignore(favorite_model, ["user_id", column]).values([{"user_id": user_id, column: i} for i in ids])
+    if db.engine.dialect.name in ("postgresql", "sqlite"):
+        added = list(db.session.execute(stmt.returning(favorite_model.__table__.c[column])).scalars())
+        adjust_favorite_counts(favorite_model, added, 1)
+        return added
+    # INSERT IGNORE can not return the inserted rows
+    if db.session.execute(stmt).rowcount == 0:
+        return []
+    recount_favorites(favorite_model, ids)
+    return ids
+
+
+def remove_favorites(favorite_model, *criteria):
+    """Deletes the favorites matching criteria and returns the favorited ids, one per removed row."""
+    _, column = FAVORITE_TARGETS[favorite_model]
+    stmt = delete(favorite_model).where(*criteria)
+    if db.engine.dialect.delete_returning:
+        removed = list(db.session.execute(stmt.returning(getattr(favorite_model, column))).scalars())
+    else:
+        removed = list(db.session.execute(select(getattr(favorite_model, column)).where(*criteria)).scalars())
+        db.session.execute(stmt)
+    adjust_favorite_counts(favorite_model, removed, -1)
+    return removed
+
+
+def parse_favorite_ids(data, action):
+    section = data.get(action) or {}
+    if not isinstance(section, dict) or any(kind not in FAVORITE_KINDS for kind in section):
+        raise APIException(f"{action} must be an object with people and/or planets id lists", status_code=400)
+    parsed = {}
+    for kind, ids in section.items():
+        if not isinstance(ids, list) or not all(is_id(i) for i in ids):
+            raise APIException(f"{action}.{kind} must be a list of integer ids", status_code=400)
+        if len(ids) > MAX_BATCH_SIZE:
+            raise APIException(f"{action}.{kind} can have at most {MAX_BATCH_SIZE} ids", status_code=400)
+        parsed[kind] = sorted(set(ids))
+    return parsed
+
+
+def bulk_toggle_favorites(data):
+    """
+    Adds and removes many favorites of one user in a single transaction, one statement
+    per favorite kind and action plus one favorites_count update. Adding an existing
+    favorite is a no-op, ids of people or planets that do not exist are skipped and
+    reported under "missing".
+    """
+    if not isinstance(data, dict) or not is_id(data.get("user_id")):
+        raise APIException("user_id is required", status_code=400)
+    user_id = data["user_id"]
+    to_add = parse_favorite_ids(data, "add")
+    to_remove = parse_favorite_ids(data, "remove")
+    if any(to_add.values()):
+        require_user(user_id)
+
+    result = {"added": {}, "removed": {}, "missing": {}}
+    for kind, ids in to_add.items():
+        model = FAVORITE_KINDS[kind]
+        if ids:
+            ids, missing = existing_targets(model, ids)
+            if missing:
+                result["missing"][kind] = missing
+            result["added"][kind] = len(add_favorites(model, user_id, ids)) if ids else 0
+    for kind, ids in to_remove.items():
+        model = FAVORITE_KINDS[kind]
+        _, column = FAVORITE_TARGETS[model]
+        if ids:
+            removed = remove_favorites(model, model.user_id == user_id, getattr(model, column).in_(ids))
+            result["removed"][kind] = len(removed)
+    db.session.commit()
+    return result
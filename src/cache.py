@@ -0,0 +1,237 @@
+"""
+Response cache for the read endpoints. Entries are keyed on the route + query string and
+scoped to a namespace ("people", "planets", ...). Writes bump the namespace generation, which
+makes every older entry of that namespace unreachable without having to scan the backend.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, request
+from replicas import reads_primary, reads_replica
+
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+class MemoryBackend:
+    """In-process LRU with a TTL. Every gunicorn worker keeps its own copy."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def get_counter(self, key):
+        with self.lock:
+            return self.counters.get(key, 0)
+
+
+class ClientBackend:
+    """
+    Shared cache through any redis-like client exposing get, set(key, value, ex=ttl) and incr,
+    so every worker sees the same entries and invalidations.
+    """
+
+    def __init__(self, client, prefix="swapi"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(f"{self.prefix}:{key}")
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl):
+        self.client.set(f"{self.prefix}:{key}", value, ex=ttl)
+
+    def incr(self, key):
+        return self.client.incr(f"{self.prefix}:{key}")
+
+    def get_counter(self, key):
+        return int(self.client.get(f"{self.prefix}:{key}") or 0)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl, settle_seconds=0):
+        self.backend = backend
+        self.ttl = ttl
+        # with read replicas: how long after a write a replica may still not have it
+        self.settle_seconds = settle_seconds
+
+    def generations(self, namespaces):
+        return ":".join(f"{ns}.{self.backend.get_counter(f'generation:{ns}')}" for ns in namespaces)
+
+    def key(self, namespaces):
+        query = urlencode(sorted(request.args.items(multi=True)))
+        return f"{self.generations(namespaces)}:{request.path}?{query}"
+
+    def invalidate(self, namespace):
+        self.backend.incr(f"generation:{namespace}")
+        if self.settle_seconds > 0:
+            self.backend.set(f"invalidated:{namespace}", "1", math.ceil(self.settle_seconds))
+
+    def storable(self, namespaces):
+        """
+        Whether what this request read can be stored. A replica read right after a write may
+        miss it, and would be cached under the generation that write started.
+        """
+        if not reads_replica():
+            return True
+        return not any(self.backend.get(f"invalidated:{namespace}") for namespace in namespaces)
+
+
+class IdentityCache:
+    """
+    Serialized entities by id for the multi-get (?ids=), always in process so a hit costs no
+    round trip. Keys carry the generations of the response cache namespaces, so the writes
+    that drop cached responses drop these entries too.
+    """
+
+    def __init__(self, responses, ttl, max_entries):
+        self.responses = responses
+        self.backend = MemoryBackend(max_entries)
+        self.ttl = ttl
+
+    def prefix(self, model, namespaces):
+        return f"{self.responses.generations(namespaces)}:{model.__tablename__}"
+
+    def get_many(self, prefix, ids):
+        found = {}
+        for entity_id in ids:
+            payload = self.backend.get(f"{prefix}:{entity_id}")
+            if payload is not None:
+                found[entity_id] = payload
+        return found
+
+    def set_many(self, prefix, payloads):
+        for entity_id, payload in payloads.items():
+            self.backend.set(f"{prefix}:{entity_id}", payload, self.ttl)
+
+
+def setup_cache(app):
+    """
+    CACHE_TTL (seconds, 0 disables the cache), CACHE_MAX_ENTRIES for the in-process LRU
+    and CACHE_URL to share the cache between workers through redis.
+    IDENTITY_CACHE_TTL (seconds, 0 disables it) and IDENTITY_CACHE_MAX_ENTRIES size the
+    in-process cache of single entities used by the multi-get.
+    """
+    ttl = int(os.environ.get("CACHE_TTL", 60))
+    cache_url = os.environ.get("CACHE_URL")
+    if cache_url:
+        import redis
+        backend = ClientBackend(redis.Redis.from_url(cache_url))
+    else:
+        backend = MemoryBackend(int(os.environ.get("CACHE_MAX_ENTRIES", 1024)))
+    replicas = app.extensions.get("replicas")
+    app.extensions["response_cache"] = ResponseCache(backend, ttl, replicas.sticky_seconds if replicas else 0)
+    identity_ttl = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+    if identity_ttl > 0:
+        app.extensions["identity_cache"] = IdentityCache(
+            app.extensions["response_cache"], identity_ttl, int(os.environ.get("IDENTITY_CACHE_MAX_ENTRIES", 10000)))
+
+
+def get_cache():
+    return current_app.extensions.get("response_cache")
+
+
+def get_identity_cache():
+    return current_app.extensions.get("identity_cache")
+
+
+def accepted_mimetype():
+    """
+    JSON_MIMETYPE or NDJSON_MIMETYPE, whichever the Accept header prefers, None when it takes
+    neither. Clients that send no Accept header (curl, most HTTP libraries) get JSON.
+    """
+    if not request.accept_mimetypes:
+        return JSON_MIMETYPE
+    return request.accept_mimetypes.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE])
+
+
+def is_cacheable_request():
+    # streamed NDJSON exports are never cached
+    if request.args.get("stream"):
+        return False
+    return accepted_mimetype() == JSON_MIMETYPE
+
+
+def cached(*namespaces):
+    """
+    Serves successful JSON GET responses from the cache and answers If-None-Match with 304.
+    The entry is dropped when any of the namespaces is invalidated.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            # clients in their sticky window read the primary, the cache may lag behind it
+            if cache is None or cache.ttl <= 0 or not is_cacheable_request() or reads_primary():
+                response = current_app.make_response(view(*args, **kwargs))
+                if not response.is_streamed:
+                    response.add_etag()
+                return response.make_conditional(request)
+
+            key = cache.key(namespaces)
+            entry = cache.backend.get(key)
+            if entry is not None:
+                entry = json.loads(entry)
+                response = current_app.response_class(entry["body"], status=entry["status"], headers=entry["headers"])
+                return response.make_conditional(request)
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response.add_etag()
+                if cache.storable(namespaces):
+                    entry = {
+                        "status": response.status_code,
+                        "headers": [[k, v] for k, v in response.headers.items() if k != "Content-Length"],
+                        "body": response.get_data(as_text=True),
+                    }
+                    cache.backend.set(key, json.dumps(entry), cache.ttl)
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def invalidates(*namespaces):
+    """Drops the cached responses of the given namespaces after a successful write."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = current_app.make_response(view(*args, **kwargs))
+            cache = get_cache()
+            if cache is not None and response.status_code < 400:
+                for namespace in namespaces:
+                    cache.invalidate(namespace)
+            return response
+        return wrapper
+    return decorator
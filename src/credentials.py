@@ -0,0 +1,86 @@
+"""
+Password hashing with werkzeug's scrypt (or pbkdf2), run on a bounded thread pool.
+OpenSSL releases the GIL while hashing, so the pool hashes on several cores at once, and
+capping it keeps a burst of signups or logins from taking every core from the other
+requests of the worker. Hashes made with older settings are replaced on the next login.
+
+PASSWORD_HASH_METHOD    werkzeug method with its cost, default scrypt:32768:8:1 (n:r:p, 32 MB
+                        of memory per hash), e.g. pbkdf2:sha256:600000
+PASSWORD_HASH_WORKERS   hashes computed at the same time per worker (default: cores)
+PASSWORD_HASH_QUEUE     hashes waiting for a free thread before requests get a 503 (default 64)
+"""
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+from utils import APIException
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_HASH_METHOD, workers=None, queue=64):
+        self.configured_method = method
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(self.workers + queue)
+
+    @cached_property
+    def method(self):
+        # werkzeug fills in the default cost of a bare "scrypt", the stored hashes carry it
+        return generate_password_hash("", self.configured_method).split("$", 1)[0]
+
+    @cached_property
+    def dummy_hash(self):
+        return generate_password_hash("", self.method)
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise APIException("Too many password checks in progress, retry shortly", status_code=503)
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, stored):
+        return stored.split("$", 1)[0] != self.method
+
+    def verify(self, stored, password):
+        """
+        Returns (matches, new hash or None). Passwords stored in plain text before hashing was
+        added are still accepted, and hashed, on login.
+        """
+        if stored is None:
+            # unknown user: spend the same time as a real check so emails can not be probed
+            self.run(check_password_hash, self.dummy_hash, password)
+            return False, None
+        if stored.startswith(HASH_PREFIXES) and stored.count("$") >= 2:
+            matches = self.run(check_password_hash, stored, password)
+        else:
+            matches = hmac.compare_digest(stored.encode(), password.encode())
+        if matches and self.needs_rehash(stored):
+            return True, self.hash(password)
+        return matches, None
+
+
+def setup_credentials(app):
+    app.extensions["password_hasher"] = PasswordHasher(
+        os.environ.get("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD),
+        int(os.environ.get("PASSWORD_HASH_WORKERS", 0)) or None,
+        int(os.environ.get("PASSWORD_HASH_QUEUE", 64)),
+    )
+
+
+def hash_password(password):
+    return current_app.extensions["password_hasher"].hash(password)
+
+
+def verify_password(stored, password):
+    return current_app.extensions["password_hasher"].verify(stored, password)
@@ -0,0 +1,279 @@
+"""
+Offline import and export of the catalog as JSONL or CSV files, the format is picked from
+the file extension:
+
+    $ flask data import people people.jsonl
+    $ flask data import favorite-people favorites.csv --chunk-size 100000
+    $ flask data export planets planets.csv
+
+Input files are memory mapped and parsed a line at a time, so their size does not matter.
+Rows are written in chunks, with COPY on Postgres (psycopg2) and a single executemany per
+chunk elsewhere. The secondary indexes of the table are dropped before the load and built
+again once at the end, which is much cheaper than updating them row by row; unique
+constraints stay, so duplicates are still rejected.
+
+An import is one transaction: if a row fails, nothing is loaded and the indexes are back.
+It locks the table while it runs, so it is meant for offline loads. Ids are taken from
+the file when present (the Postgres sequence is moved past them) and the users referenced
+by people and favorites must already exist. Empty values load as NULL.
+"""
+import csv
+import io
+import json
+import mmap
+import os
+import time
+import click
+from sqlalchemy import Integer, func, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from bulk import FAVORITE_TARGETS, recount_statement
+from cache import get_cache
+from models import db, People, Planet, Vehicle, FavoritePeople, FavoritePlanet
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# dataset name -> (model, response cache namespaces its rows appear in)
+DATASETS = {
+    "people": (People, ("people", "users")),
+    "planets": (Planet, ("planets",)),
+    "vehicles": (Vehicle, ("vehicles",)),
+    "favorite-people": (FavoritePeople, ("favorites",)),
+    "favorite-planets": (FavoritePlanet, ("favorites",)),
+}
+FORMATS = {".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+
+data_cli = click.Group("data", help="Import and export the catalog as JSONL or CSV files.")
+
+
+def file_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise click.BadParameter(f"expected one of {', '.join(FORMATS)}", param_hint="PATH")
+    return FORMATS[extension]
+
+
+def mapped_lines(path):
+    """The lines of path, read through a memory map instead of buffered reads."""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            yield from iter(mapped.readline, b"")
+
+
+def read_rows(path, table):
+    """
+    The columns of the file and an iterator over its rows as tuples in that order. JSONL
+    takes its columns from the first record, CSV from its header line.
+    """
+    lines = mapped_lines(path)
+    csv_format = file_format(path) == "csv"
+    if csv_format:
+        reader = csv.reader(line.decode() for line in lines)
+        columns = next(reader, [])
+        rows = (row for row in reader if row)
+    else:
+        records = (json.loads(line.decode()) for line in lines if line.strip())
+        first = next(records, None)
+        columns = list(first) if first else []
+
+        def rows_of(records):
+            if first is not None:
+                yield tuple(map(first.get, columns))
+            for record in records:
+                yield tuple(map(record.get, columns))
+        rows = rows_of(records)
+
+    unknown = [name for name in columns if name not in table.c]
+    if unknown:
+        raise click.ClickException(f"Unknown columns for {table.name}: {', '.join(unknown)}")
+    if csv_format:
+        converters = [converter(table.c[name]) for name in columns]
+        rows = (tuple(convert(value) for convert, value in zip(converters, row)) for row in rows)
+    return columns, rows
+
+
+def converter(column):
+    # CSV values are all strings: empty ones are NULL, numbers are stored as numbers
+    if isinstance(column.type, Integer):
+        return lambda value: int(value) if value != "" else None
+    return lambda value: value if value != "" else None
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Progress:
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.rows / max(time.perf_counter() - self.start, 1e-9)
+
+    def add(self, rows):
+        self.rows += rows
+        click.echo(f"{self.label}: {self.rows} rows, {self.rate:,.0f} rows/s", err=True)
+
+    def done(self, action):
+        elapsed = time.perf_counter() - self.start
+        click.echo(f"{action} {self.rows} rows of {self.label} in {elapsed:.1f}s ({self.rate:,.0f} rows/s)")
+
+
+def uses_copy(connection):
+    return connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2"
+
+
+def copy_chunk(connection, table, columns, chunk):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+    quote = connection.dialect.identifier_preparer.quote
+    names = ", ".join(quote(name) for name in columns)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {quote(table.name)} ({names}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def column_default(column):
+    if column.default is None or not column.default.is_scalar:
+        raise click.ClickException(f"The file has no {column.name} column, which {column.table.name} needs")
+    return column.default.arg
+
+
+def driver_insert(connection, table, columns):
+    """
+    The INSERT for columns as driver SQL and a function turning a row of the file into its
+    parameters. Chunks go straight to the driver's executemany, skipping the per row
+    parameter processing of SQLAlchemy, which costs more than the insert itself.
+    """
+    compiled = insert(table).compile(connection, column_keys=columns)
+    keys = list(compiled.positiontup if compiled.positional else compiled.construct_params(dict.fromkeys(columns)))
+    # columns missing from the file get their python side default, as with the ORM
+    defaults = {key: column_default(table.c[key]) for key in keys if key not in columns}
+    if not compiled.positional:
+        return str(compiled), lambda row: {**defaults, **dict(zip(columns, row))}
+    if keys[:len(columns)] == columns:
+        extra = tuple(defaults[key] for key in keys[len(columns):])
+        return str(compiled), lambda row: row + extra
+    index = {name: i for i, name in enumerate(columns)}
+    return str(compiled), lambda row: tuple(row[index[key]] if key in index else defaults[key] for key in keys)
+
+
+def secondary_indexes(table):
+    return [index for index in table.indexes if not index.unique]
+
+
+def move_sequence(connection, table):
+    """After loading explicit ids, makes the id sequence continue past the largest one."""
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(
+        select(func.setval(func.pg_get_serial_sequence(table.name, "id"), func.coalesce(func.max(table.c.id), 1)))
+    )
+
+
+def load(model, columns, rows, chunk_size, keep_indexes, progress):
+    table = model.__table__
+    with db.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # a load and its index builds run far longer than DB_STATEMENT_TIMEOUT_MS allows
+            connection.execute(text("SET LOCAL statement_timeout = 0"))
+            connection.execute(text("SET LOCAL synchronous_commit = off"))
+        elif connection.dialect.name == "sqlite":
+            # pysqlite only opens its transaction before DML, so the index drops below
+            # would commit on their own and a failed load would leave the table without them
+            connection.exec_driver_sql("BEGIN")
+        indexes = [] if keep_indexes else secondary_indexes(table)
+        for index in indexes:
+            index.drop(connection, checkfirst=True)
+
+        copy = uses_copy(connection)
+        statement, parameters = driver_insert(connection, table, columns)
+        for chunk in chunks(rows, chunk_size):
+            if copy:
+                copy_chunk(connection, table, columns, chunk)
+            else:
+                connection.exec_driver_sql(statement, [parameters(row) for row in chunk])
+            progress.add(len(chunk))
+
+        started = time.perf_counter()
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+        if indexes:
+            click.echo(f"rebuilt {len(indexes)} indexes in {time.perf_counter() - started:.1f}s", err=True)
+        if "id" in columns:
+            move_sequence(connection, table)
+        if model in FAVORITE_TARGETS:
+            connection.execute(recount_statement(model))
+
+
+@data_cli.command("import")
+@click.argument("dataset", type=click.Choice(list(DATASETS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, help="Rows written per statement.")
+@click.option("--keep-indexes", is_flag=True, help="Update the indexes row by row instead of rebuilding them.")
+def import_command(dataset, path, chunk_size, keep_indexes):
+    """Load a JSONL or CSV file into a table."""
+    model, namespaces = DATASETS[dataset]
+    columns, rows = read_rows(path, model.__table__)
+    if not columns:
+        raise click.ClickException(f"{path} has no rows")
+    progress = Progress(dataset)
+    try:
+        load(model, columns, rows, chunk_size, keep_indexes, progress)
+    except IntegrityError as error:
+        raise click.ClickException(f"{error.orig}, nothing was imported")
+
+    cache = get_cache()
+    if cache is not None:
+        for namespace in namespaces:
+            cache.invalidate(namespace)
+    progress.done("imported")
+
+
+@data_cli.command("export")
+@click.argument("dataset", type=click.Choice(list(DATASETS)))
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, help="Rows fetched at a time.")
+def export_command(dataset, path, chunk_size):
+    """Write a table to a JSONL or CSV file, ordered by id."""
+    model, _ = DATASETS[dataset]
+    table = model.__table__
+    fmt = file_format(path)
+    progress = Progress(dataset)
+
+    with db.engine.connect() as connection, open(path, "w", newline="" if fmt == "csv" else None) as file:
+        if fmt == "csv" and uses_copy(connection):
+            stmt = select(table).order_by(table.c.id).compile(connection, compile_kwargs={"literal_binds": True})
+            with connection.connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY ({stmt}) TO STDOUT WITH (FORMAT csv, HEADER)", file)
+                progress.add(cursor.rowcount)
+        else:
+            result = connection.execution_options(yield_per=chunk_size).execute(select(table).order_by(table.c.id))
+            keys = list(result.keys())
+            writer = csv.writer(file) if fmt == "csv" else None
+            if writer:
+                writer.writerow(keys)
+            for partition in result.partitions():
+                if writer:
+                    writer.writerows(partition)
+                else:
+                    file.writelines(json.dumps(dict(zip(keys, row))) + "\n" for row in partition)
+                progress.add(len(partition))
+    progress.done("exported")
+
+
+def setup_dataset(app):
+    app.cli.add_command(data_cli)
@@ -0,0 +1,188 @@
+"""
+Database engine configuration, read from the environment:
+
+DATABASE_URL              postgres/mysql url, falls back to sqlite:////tmp/test.db
+DB_POOL_SIZE              connections kept open per worker (default 5)
+DB_MAX_OVERFLOW           extra connections allowed under bursts (default 10)
+DB_POOL_TIMEOUT           seconds to wait for a free connection (default 30)
+DB_POOL_RECYCLE           seconds after which a connection is replaced (default 1800)
+DB_POOL_PRE_PING          test connections before using them (default 1)
+DB_STATEMENT_TIMEOUT_MS   abort statements running longer than this on Postgres (default off)
+DB_PGBOUNCER              1 when connecting through PgBouncer in transaction mode: no client
+                          side pool and no session level settings
+SQLITE_BUSY_TIMEOUT_MS    how long SQLite waits on a locked database (default 5000)
+
+The `flask db` migration commands are registered by setup_migrate and load flask_migrate
+on first use.
+"""
+import os
+import threading
+import time
+import click
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def database_url():
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is None:
+        return "sqlite:////tmp/test.db"
+    return db_url.replace("postgres://", "postgresql://")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long requests wait to get a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self.wait_lock:
+                self.wait_count += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+def pool_options():
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", "1"),
+    }
+
+
+def engine_options(url, **pool_overrides):
+    if env_flag("DB_PGBOUNCER", "0"):
+        # PgBouncer already pools; a second pool in every worker only holds connections hostage
+        return {"poolclass": NullPool}
+    options = {"poolclass": TimedQueuePool, **pool_options(), **pool_overrides}
+    statement_timeout = os.environ.get("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and url.startswith("postgresql"):
+        options["connect_args"] = {"options": f"-c statement_timeout={int(statement_timeout)}"}
+    return options
+
+
+def async_engine_options(url):
+    """Same settings for the async engine of the ASGI entry point (asyncpg/aiosqlite)."""
+    asyncpg = url.startswith("postgresql")
+    if env_flag("DB_PGBOUNCER", "0"):
+        # asyncpg prepares statements by default, which breaks on PgBouncer transaction pooling
+        return {"poolclass": NullPool, "connect_args": {"statement_cache_size": 0} if asyncpg else {}}
+    options = pool_options()
+    statement_timeout = os.environ.get("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and asyncpg:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(int(statement_timeout))}}
+    return options
+
+
+def sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run while a writer commits, NORMAL sync is safe with WAL and much faster
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    # off by default on SQLite; deletes rely on ON DELETE CASCADE to remove dependent rows
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def local_statement_timeout(connection):
+    # PgBouncer in transaction mode rejects startup options, so the timeout is set per transaction
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(os.environ['DB_STATEMENT_TIMEOUT_MS'])}")
+
+
+def setup_database(app, db, **pool_overrides):
+    """pool_overrides (pool_size, max_overflow, ...) replace the DB_POOL_* settings for this app."""
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url, **pool_overrides)
+    db.init_app(app)
+
+    with app.app_context():
+        configure_engine(db.engine)
+
+
+def configure_engine(engine):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", sqlite_pragmas)
+    elif engine.dialect.name == "postgresql" and env_flag("DB_PGBOUNCER", "0") \
+            and os.environ.get("DB_STATEMENT_TIMEOUT_MS"):
+        event.listen(engine, "begin", local_statement_timeout)
+
+
+class LazyMigrateCommands(click.Group):
+    """
+    The `flask db` commands. flask_migrate, and alembic with it, is only imported when one of
+    them runs, instead of by every web worker at boot.
+    """
+
+    def __init__(self, app, db, **kwargs):
+        super().__init__("db", help="Perform database migrations.")
+        self.app, self.db, self.kwargs = app, db, kwargs
+        self.commands_group = None
+
+    def load(self):
+        if self.commands_group is None:
+            from flask_migrate import Migrate
+            # registers the real group on app.cli, replacing this one
+            Migrate(self.app, self.db, **self.kwargs)
+            self.commands_group = self.app.cli.commands["db"]
+        return self.commands_group
+
+    def list_commands(self, ctx):
+        return self.load().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self.load().get_command(ctx, name)
+
+
+def setup_migrate(app, db):
+    app.cli.add_command(LazyMigrateCommands(app, db, include_object=include_object))
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """
+    Alembic autogenerate filter: indexes limited to one database with Index.ddl_if (like the
+    Postgres text_pattern_ops ones) are left out when migrating any other database.
+    """
+    from alembic import context
+    ddl_if = getattr(object, "_ddl_if", None)
+    if type_ == "index" and ddl_if is not None and ddl_if.dialect:
+        return context.get_context().dialect.name == ddl_if.dialect
+    return True
+
+
+def pool_status(engine):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    status = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    if isinstance(pool, TimedQueuePool):
+        with pool.wait_lock:
+            status["wait_count"] = pool.wait_count
+            status["wait_seconds_total"] = round(pool.wait_seconds_total, 6)
+            status["wait_seconds_max"] = round(pool.wait_seconds_max, 6)
+    return status
@@ -0,0 +1,172 @@
+"""
+Per route request metrics in the Prometheus text format, served at /metrics:
+latency histogram, SQL statement count and time, JSON encoding time and response bytes,
+plus the state of the connection pool. Every gunicorn worker keeps its own numbers.
+
+SERVER_TIMING=1       adds a Server-Timing header (db, serialize, total) to every response
+SLOW_QUERY_MS=500     statements slower than this are logged with their SQL
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from db_config import pool_status
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("swapi.slow_queries")
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self.latency_sum = defaultdict(float)
+        self.latency_count = defaultdict(int)
+        self.response_bytes = defaultdict(int)
+        self.sql_count = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+        self.serialize_seconds = defaultdict(float)
+
+    def observe(self, route, method, status, latency, size, sql_count, sql_seconds, serialize_seconds):
+        key = (route, method)
+        with self.lock:
+            self.requests[(route, method, status)] += 1
+            buckets = self.latency_buckets[key]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    buckets[i] += 1
+            self.latency_sum[key] += latency
+            self.latency_count[key] += 1
+            self.response_bytes[key] += size
+            self.sql_count[key] += sql_count
+            self.sql_seconds[key] += sql_seconds
+            self.serialize_seconds[key] += serialize_seconds
+
+    def render(self, engine):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            family("http_requests_total", "counter", "Requests handled, by route, method and status.")
+            for (route, method, status), value in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{route="{route}",method="{method}",status="{status}"}} {value}')
+
+            family("http_request_duration_seconds", "histogram", "Time spent handling a request.")
+            for (route, method), buckets in sorted(self.latency_buckets.items()):
+                labels = f'route="{route}",method="{method}"'
+                for bound, value in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {value}')
+                count = self.latency_count[(route, method)]
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {self.latency_sum[(route, method)]:.6f}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {count}")
+
+            for name, kind, help_text, values in (
+                ("http_response_bytes_total", "counter", "Bytes sent in response bodies.", self.response_bytes),
+                ("db_statements_total", "counter", "SQL statements executed.", self.sql_count),
+                ("db_statement_seconds_total", "counter", "Time spent running SQL statements.", self.sql_seconds),
+                ("json_serialize_seconds_total", "counter", "Time spent encoding JSON responses.", self.serialize_seconds),
+            ):
+                family(name, kind, help_text)
+                for (route, method), value in sorted(values.items()):
+                    formatted = f"{value:.6f}" if isinstance(value, float) else value
+                    lines.append(f'{name}{{route="{route}",method="{method}"}} {formatted}')
+
+        pool = pool_status(engine)
+        for key, name, kind in (
+            ("checked_out", "db_pool_checked_out", "gauge"),
+            ("overflow", "db_pool_overflow", "gauge"),
+            ("size", "db_pool_size", "gauge"),
+            ("wait_count", "db_pool_checkouts_total", "counter"),
+            ("wait_seconds_total", "db_pool_wait_seconds_total", "counter"),
+            ("wait_seconds_max", "db_pool_wait_seconds_max", "gauge"),
+        ):
+            if key in pool:
+                family(name, kind, f"Connection pool {key.replace('_', ' ')}.")
+                lines.append(f"{name} {pool[key]}")
+        return "\n".join(lines) + "\n"
+
+
+class TimedJSONProvider:
+    """Wraps the app JSON provider to add the time spent encoding responses to the request."""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.provider.response(*args, **kwargs)
+        finally:
+            if has_request_context():
+                g.serialize_seconds = g.get("serialize_seconds", 0.0) + time.perf_counter() - start
+
+
+def setup_metrics(app, db):
+    metrics = Metrics()
+    app.extensions["metrics"] = metrics
+    server_timing = os.environ.get("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+    slow_query_seconds = float(os.environ.get("SLOW_QUERY_MS", 500)) / 1000
+    app.json = TimedJSONProvider(app.json)
+
+    with app.app_context():
+        engine = db.engine
+    replicas = app.extensions.get("replicas")
+
+    # the start is kept on the execution context, which is dropped with the statement: after_cursor_execute
+    # does not run for failed statements, so a stack on the connection would grow with every failure
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "query_start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if has_request_context():
+            g.sql_count = g.get("sql_count", 0) + 1
+            g.sql_seconds = g.get("sql_seconds", 0.0) + elapsed
+        if elapsed >= slow_query_seconds:
+            logger.warning("slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+    for timed in [engine] + ([replica.engine for replica in replicas.replicas] if replicas else []):
+        event.listen(timed, "before_cursor_execute", before_cursor_execute)
+        event.listen(timed, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if "request_start" not in g:
+            return response
+        latency = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        sql_seconds = g.get("sql_seconds", 0.0)
+        serialize_seconds = g.get("serialize_seconds", 0.0)
+        size = 0 if response.is_streamed else response.calculate_content_length() or 0
+        metrics.observe(route, request.method, response.status_code, latency, size,
+                        g.get("sql_count", 0), sql_seconds, serialize_seconds)
+        if server_timing:
+            response.headers["Server-Timing"] = (
+                f'db;dur={sql_seconds * 1000:.2f};desc="{g.get("sql_count", 0)} statements", '
+                f"serialize;dur={serialize_seconds * 1000:.2f}, total;dur={latency * 1000:.2f}"
+            )
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        return Response(metrics.render(engine), mimetype="text/plain; version=0.0.4")
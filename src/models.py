@@ -1,79 +1,112 @@
+from operator import attrgetter
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, ForeignKey
+from sqlalchemy import String, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+class FieldSerializer:
+    """
+    Generates serialize() once per class from serialize_fields, the plain columns a model
+    exposes. The same list lets queries build the payload straight from result rows.
+    """
+    serialize_fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = cls.serialize_fields
+        getter = attrgetter(*fields)
+        if len(fields) == 1:
+            cls.serialize = lambda self: {fields[0]: getter(self)}
+        else:
+            cls.serialize = lambda self: dict(zip(fields, getter(self)))
 
 class User(db.Model):
     __tablename__ = "users"
+    hidden_fields = ("password",)
+    readonly_fields = ("version",)
     id: Mapped[int] = mapped_column(primary_key=True)
     email: Mapped[str] = mapped_column(String(120), unique=True, nullable=False)
+    # werkzeug scrypt hash, see credentials.py
     password: Mapped[str] = mapped_column(nullable=False)
+    # bumped by every update, sent in the ETag and checked against If-Match
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
-    people: Mapped["People"] = relationship(back_populates="user", uselist=False)
-    favorite_people: Mapped[list["FavoritePeople"]] = relationship("FavoritePeople", backref="user", cascade="all, delete-orphan")
-    favorite_planets: Mapped[list["FavoritePlanet"]] = relationship("FavoritePlanet", backref="user", cascade="all, delete-orphan")
+    # favorites are removed by ON DELETE CASCADE in the database, never loaded to be deleted.
+    # The person is catalog data and stays, ON DELETE SET NULL only unlinks it
+    people: Mapped["People"] = relationship(back_populates="user", uselist=False, passive_deletes=True)
+    favorite_people: Mapped[list["FavoritePeople"]] = relationship("FavoritePeople", backref="user", cascade="all, delete-orphan", passive_deletes=True)
+    favorite_planets: Mapped[list["FavoritePlanet"]] = relationship("FavoritePlanet", backref="user", cascade="all, delete-orphan", passive_deletes=True)
 
     def serialize(self):
         return {
             "id": self.id,
             "email": self.email,
-            "password": self.password,
             "people": self.people.serialize() if self.people else None
         }
 
-class People(db.Model):
+class People(FieldSerializer, db.Model):
     __tablename__ = "peoples"
+    __table_args__ = (
+        Index("ix_peoples_gender_id", "gender", "id"),
+        Index("ix_peoples_favorites_count_id", "favorites_count", "id"),
+        Index("ix_peoples_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}).ddl_if(dialect="postgresql"),
+    )
+    serialize_fields = ("id", "name", "gender")
+    prefix_fields = ("name",)
+    filter_fields = ("gender",)
+    readonly_fields = ("favorites_count", "version")
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(120), unique=True, nullable=False)
     gender: Mapped[str] = mapped_column(String(80), nullable=False)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int | None] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    # maintained by the favorite write paths, see bulk.add_favorites/remove_favorites
+    favorites_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
     user: Mapped["User"] = relationship(back_populates="people")
-    favorites: Mapped[list["FavoritePeople"]] = relationship("FavoritePeople", backref="people", cascade="all, delete-orphan")
+    favorites: Mapped[list["FavoritePeople"]] = relationship(back_populates="people", cascade="all, delete-orphan", passive_deletes=True)
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "gender": self.gender,
-        }
-
-class Vehicle(db.Model):
+class Vehicle(FieldSerializer, db.Model):
     __tablename__ = "vehicles"
+    serialize_fields = ("id", "name", "model")
+    readonly_fields = ("version",)
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(80), unique=True, nullable=False)
     model: Mapped[str] = mapped_column(String(80), nullable=False)
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "model": self.model,
-        }
-
-class Planet(db.Model):
+class Planet(FieldSerializer, db.Model):
     __tablename__ = "planets"
+    __table_args__ = (
+        Index("ix_planets_terrain_id", "terrain", "id"),
+        Index("ix_planets_climate_id", "climate", "id"),
+        Index("ix_planets_favorites_count_id", "favorites_count", "id"),
+        Index("ix_planets_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}).ddl_if(dialect="postgresql"),
+    )
+    serialize_fields = ("id", "name", "terrain", "climate")
+    prefix_fields = ("name",)
+    filter_fields = ("terrain", "climate")
+    readonly_fields = ("favorites_count", "version")
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(80), unique=True, nullable=False)
     terrain: Mapped[str] = mapped_column(String(80), nullable=False)
     climate: Mapped[str] = mapped_column(String(80), nullable=False)
+    # maintained by the favorite write paths, see bulk.add_favorites/remove_favorites
+    favorites_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
 
-    favorites: Mapped[list["FavoritePlanet"]] = relationship("FavoritePlanet", backref="planet", cascade="all, delete-orphan")
-
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "terrain": self.terrain,
-            "climate": self.climate,
-        }
+    favorites: Mapped[list["FavoritePlanet"]] = relationship(back_populates="planet", cascade="all, delete-orphan", passive_deletes=True)
 
 class FavoritePeople(db.Model):
     __tablename__ = "favorite_people"
+    __table_args__ = (UniqueConstraint("user_id", "people_id", name="uq_favorite_people_user_people"),)
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    people_id: Mapped[int] = mapped_column(ForeignKey("peoples.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    people_id: Mapped[int] = mapped_column(ForeignKey("peoples.id", ondelete="CASCADE"), index=True)
+
+    people: Mapped["People"] = relationship(back_populates="favorites")
 
     def serialize(self):
         return {
@@ -85,9 +118,12 @@ class FavoritePeople(db.Model):
 
 class FavoritePlanet(db.Model):
     __tablename__ = "favorite_planet"
+    __table_args__ = (UniqueConstraint("user_id", "planet_id", name="uq_favorite_planet_user_planet"),)
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    planet_id: Mapped[int] = mapped_column(ForeignKey("planets.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    planet_id: Mapped[int] = mapped_column(ForeignKey("planets.id", ondelete="CASCADE"), index=True)
+
+    planet: Mapped["Planet"] = relationship(back_populates="favorites")
 
     def serialize(self):
         return {
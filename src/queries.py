@@ -0,0 +1,389 @@
+import base64
+import binascii
+import hashlib
+import json
+import sys
+from flask import Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import and_, literal, null, or_, select, tuple_, union_all
+from sqlalchemy.orm import joinedload, selectinload
+from cache import NDJSON_MIMETYPE, accepted_mimetype, get_identity_cache
+from models import db, User, People, Planet, FavoritePeople, FavoritePlanet
+from replicas import reads_primary
+from utils import APIException
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_LEADERBOARD_SIZE = 100
+MAX_IDS = 500
+STREAM_BATCH_SIZE = 1000
+# integers past a signed 64 bit value can not be bound as parameters (OverflowError)
+MAX_INTEGER = 2**63 - 1
+# label of the order column when it is read only for the next cursor, see build_select
+ORDER_KEY = "_order_key"
+
+# Eager loading strategies, picked per endpoint so serialize() never lazy loads row by row.
+# One-to-one/many collections use a second IN query, many-to-one references are joined.
+USER_LOADS = (selectinload(User.people),)
+FAVORITE_PEOPLE_LOADS = (joinedload(FavoritePeople.people),)
+FAVORITE_PLANET_LOADS = (joinedload(FavoritePlanet.planet),)
+
+
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, schema=None):
+    """Decodes an opaque cursor into a dict, checking every key of schema (name -> type)."""
+    schema = schema or {"id": int}
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))
+        values = {name: key[name] for name in schema}
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise APIException("Invalid cursor", status_code=400)
+    if not all(valid_cursor_value(values[name], kind) for name, kind in schema.items()):
+        raise APIException("Invalid cursor", status_code=400)
+    return values
+
+
+def valid_cursor_value(value, kind):
+    if kind is int:
+        # bool is an int subclass
+        return isinstance(value, int) and not isinstance(value, bool) and -MAX_INTEGER - 1 <= value <= MAX_INTEGER
+    return isinstance(value, kind)
+
+
+def parse_limit(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    raw = args.get("limit")
+    if raw is None:
+        return default
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1 or limit > maximum:
+        raise APIException(f"limit must be between 1 and {maximum}", status_code=400)
+    return limit
+
+
+def parse_ids(args):
+    """?ids=1,2,3 as a list of distinct ids in the requested order, None without ?ids=."""
+    raw = args.get("ids")
+    if raw is None:
+        return None
+    try:
+        ids = [int(part) for part in raw.split(",") if part.strip()]
+        if any(abs(i) > MAX_INTEGER for i in ids):
+            raise ValueError
+    except ValueError:
+        raise APIException("ids must be a comma separated list of integers", status_code=400)
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > MAX_IDS:
+        raise APIException(f"ids must list between 1 and {MAX_IDS} ids", status_code=400)
+    return ids
+
+
+def projectable_columns(model):
+    # Hidden fields (like passwords) can never be requested through ?fields=
+    hidden = getattr(model, "hidden_fields", ())
+    return {c.key: c for c in model.__table__.columns if c.key not in hidden}
+
+
+def parse_fields(model, args):
+    raw = args.get("fields")
+    if not raw:
+        return None
+    available = projectable_columns(model)
+    names = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400,
+                           payload={"allowed": sorted(available)})
+    # the primary key is always returned, the next cursor is built from it
+    if "id" not in names:
+        names.insert(0, "id")
+    return [getattr(model, name) for name in names]
+
+
+def select_columns(model, args):
+    """
+    The columns to read for a listing: the ?fields= projection, else the serialize_fields of
+    flat models, whose payload is built straight from the result rows without ORM objects.
+    None means the model has a custom serialize() and has to be loaded through the ORM.
+    """
+    columns = parse_fields(model, args)
+    if columns is None and getattr(model, "serialize_fields", None):
+        columns = [getattr(model, name) for name in model.serialize_fields]
+    return columns
+
+
+def parse_order(model, args):
+    """?order_by=<field> or ?order_by=-<field> for descending, id is the tie breaker."""
+    raw = args.get("order_by") or "id"
+    name = raw[1:] if raw.startswith("-") else raw
+    allowed = ("id",) + getattr(model, "prefix_fields", ()) + getattr(model, "filter_fields", ())
+    if name not in allowed:
+        raise APIException(f"Can not order by {name}", status_code=400, payload={"allowed": list(allowed)})
+    return name, raw.startswith("-")
+
+
+def prefix_upper_bound(prefix):
+    """The smallest string above every string that starts with prefix, None when there is none."""
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:
+            # surrogates can not be encoded, U+E000 is the character that follows U+D7FF
+            code = 0xE000
+        if code <= sys.maxunicode:
+            return prefix[:-1] + chr(code)
+        # nothing follows U+10FFFF, the bound moves up to the previous character
+        prefix = prefix[:-1]
+    return None
+
+
+def prefix_range(column, prefix):
+    """Range condition matching the values that start with prefix, served by a plain btree index."""
+    upper = prefix_upper_bound(prefix)
+    if upper is None:
+        return column >= prefix
+    return and_(column >= prefix, column < upper)
+
+
+def prefix_filter(column, prefix):
+    if db.engine.dialect.name == "postgresql":
+        # LIKE 'abc%' is served by the text_pattern_ops index
+        return column.startswith(prefix, autoescape=True)
+    # a range scan on the btree index; LIKE is case insensitive on SQLite and can not use it
+    return prefix_range(column, prefix)
+
+
+def apply_filters(model, stmt, args):
+    for name in getattr(model, "prefix_fields", ()):
+        if args.get(name):
+            stmt = stmt.where(prefix_filter(getattr(model, name), args[name]))
+    for name in getattr(model, "filter_fields", ()):
+        if args.get(name):
+            stmt = stmt.where(getattr(model, name) == args[name])
+    return stmt
+
+
+def build_select(model, columns, options=()):
+    """
+    Filtered, ordered select positioned after the ?after= cursor. Ordering is keyset based
+    on (order column, id), which the composite indexes of the filter columns cover.
+    """
+    order_name, descending = parse_order(model, request.args)
+    order_column = getattr(model, order_name)
+    if columns is None:
+        stmt = select(model).options(*options)
+    else:
+        if order_name not in [c.key for c in columns]:
+            # read for the next cursor only, row_payload() leaves it out of the items
+            columns = columns + [order_column.label(ORDER_KEY)]
+        stmt = select(*columns)
+    stmt = apply_filters(model, stmt, request.args)
+
+    after = request.args.get("after")
+    if order_name == "id":
+        if after:
+            last_id = decode_cursor(after)["id"]
+            stmt = stmt.where(model.id < last_id if descending else model.id > last_id)
+        return stmt.order_by(model.id.desc() if descending else model.id)
+
+    if after:
+        cursor = decode_cursor(after, {"key": str, "id": int})
+        position = tuple_(order_column, model.id)
+        stmt = stmt.where(position < (cursor["key"], cursor["id"]) if descending
+                          else position > (cursor["key"], cursor["id"]))
+    if descending:
+        return stmt.order_by(order_column.desc(), model.id.desc())
+    return stmt.order_by(order_column, model.id)
+
+
+def page_query(model, options=()):
+    """
+    The statement for the requested page (one extra row tells whether there is a next page),
+    whether it loads ORM objects, and the page size. read_page() turns its result into a page.
+    """
+    limit = parse_limit(request.args)
+    columns = select_columns(model, request.args)
+    return build_select(model, columns, options).limit(limit + 1), columns is None, limit
+
+
+def row_payload(row):
+    payload = row._asdict()
+    payload.pop(ORDER_KEY, None)
+    return payload
+
+
+def read_page(model, result, orm, limit):
+    if orm:
+        rows = result.scalars().all()
+        items = [row.serialize() for row in rows[:limit]]
+    else:
+        rows = result.all()
+        items = [row_payload(row) for row in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        order_name, _ = parse_order(model, request.args)
+        if order_name == "id":
+            key = {"id": last.id}
+        else:
+            order_key = ORDER_KEY if not orm and ORDER_KEY in last._fields else order_name
+            key = {"key": getattr(last, order_key), "id": last.id}
+        next_cursor = encode_cursor(key)
+    return items, next_cursor
+
+
+def paginate(model, options=()):
+    """
+    Keyset pagination driven by the request query string:
+    ?limit=<n>&after=<cursor>&fields=<a,b,c>&order_by=<[-]field> plus the model filters.
+    Returns the serialized page and the cursor of the next page (or None).
+    """
+    stmt, orm, limit = page_query(model, options)
+    return read_page(model, db.session.execute(stmt), orm, limit)
+
+
+def get_many(model, ids, options=(), namespaces=()):
+    """
+    The entities of ids in the requested order and the ids that do not exist. Entities in
+    the identity cache are served from it, the others are read with one WHERE id IN (...)
+    query. The cache is keyed on the generations of namespaces, the response cache
+    namespaces whose writes change the payload. ?fields= projections and clients in their
+    replica sticky window bypass it, like they bypass the response cache.
+    """
+    columns = select_columns(model, request.args)
+    cache = get_identity_cache() if namespaces and not request.args.get("fields") and not reads_primary() else None
+    prefix = cache.prefix(model, namespaces) if cache else None
+    found = cache.get_many(prefix, ids) if cache else {}
+
+    wanted = [entity_id for entity_id in ids if entity_id not in found]
+    if wanted:
+        if columns is None:
+            stmt = select(model).where(model.id.in_(wanted)).options(*options)
+            loaded = {entity.id: entity.serialize() for entity in db.session.execute(stmt).scalars()}
+        else:
+            stmt = select(*columns).where(model.id.in_(wanted))
+            loaded = {row.id: row._asdict() for row in db.session.execute(stmt)}
+        if cache and cache.responses.storable(namespaces):
+            cache.set_many(prefix, loaded)
+        found.update(loaded)
+
+    items = [found[entity_id] for entity_id in ids if entity_id in found]
+    missing = [entity_id for entity_id in ids if entity_id not in found]
+    return items, missing
+
+
+def get_many_response(model, ids, options=(), namespaces=()):
+    items, missing = get_many(model, ids, options, namespaces)
+    return jsonify({"items": items, "missing": missing})
+
+
+def page_response(items, next_cursor):
+    response = jsonify(items)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def etag_headers(entity, payload):
+    """
+    The ETag of a single entity is its version, which every update bumps and If-Match is
+    checked against, followed by a hash of the payload. The version alone repeats when a row
+    is deleted and created again under the same id, and misses changes to embedded entities
+    (the person of a user), which do not bump it.
+    """
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return {"ETag": f'"{entity.version}-{hashlib.sha1(body).hexdigest()[:16]}"'}
+
+
+def wants_stream():
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    return accepted_mimetype() == NDJSON_MIMETYPE
+
+
+def stream_response(model, options=()):
+    """
+    Streams every row (from ?after= on) as newline delimited JSON. Rows are fetched
+    in batches through a server side cursor so memory stays constant during exports.
+    """
+    columns = select_columns(model, request.args)
+    stmt = build_select(model, columns, options).execution_options(yield_per=STREAM_BATCH_SIZE)
+    dumps = current_app.json.dumps
+
+    def generate():
+        result = db.session.execute(stmt)
+        if columns is None:
+            for row in result.scalars():
+                yield dumps(row.serialize()) + "\n"
+        else:
+            for row in result:
+                yield dumps(row_payload(row)) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def user_favorites_page(user_id):
+    """
+    Pages both favorite kinds of a user from a single UNION ALL query joined with the
+    favorited entity, ordered by (kind, favorite id) so it can be keyset paged.
+    """
+    limit = parse_limit(request.args)
+    people = (
+        select(literal("people").label("kind"), FavoritePeople.id, FavoritePeople.user_id,
+               People.id.label("entity_id"), People.name, People.gender,
+               null().label("terrain"), null().label("climate"))
+        .join(People, People.id == FavoritePeople.people_id)
+        .where(FavoritePeople.user_id == user_id)
+    )
+    planets = (
+        select(literal("planet").label("kind"), FavoritePlanet.id, FavoritePlanet.user_id,
+               Planet.id.label("entity_id"), Planet.name, null().label("gender"),
+               Planet.terrain, Planet.climate)
+        .join(Planet, Planet.id == FavoritePlanet.planet_id)
+        .where(FavoritePlanet.user_id == user_id)
+    )
+    favorites = union_all(people, planets).subquery()
+    stmt = select(favorites)
+    after = request.args.get("after")
+    if after:
+        key = decode_cursor(after, {"kind": str, "id": int})
+        stmt = stmt.where(or_(favorites.c.kind > key["kind"],
+                              and_(favorites.c.kind == key["kind"], favorites.c.id > key["id"])))
+    stmt = stmt.order_by(favorites.c.kind, favorites.c.id).limit(limit + 1)
+
+    rows = db.session.execute(stmt).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    result = {"people": [], "planets": []}
+    for row in rows:
+        if row.kind == "people":
+            result["people"].append({
+                "id": row.id,
+                "user_id": row.user_id,
+                "people_id": row.entity_id,
+                "people": {"id": row.entity_id, "name": row.name, "gender": row.gender},
+            })
+        else:
+            result["planets"].append({
+                "id": row.id,
+                "user_id": row.user_id,
+                "planet_id": row.entity_id,
+                "planet": {"id": row.entity_id, "name": row.name,
+                           "terrain": row.terrain, "climate": row.climate},
+            })
+    next_cursor = encode_cursor({"kind": rows[-1].kind, "id": rows[-1].id}) if has_more else None
+    return result, next_cursor
+
+
+def most_favorited(model):
+    """Top ?limit= (default 10) entities by favorites_count, read from the (favorites_count, id) index."""
+    limit = parse_limit(request.args, default=10, maximum=MAX_LEADERBOARD_SIZE)
+    columns = [getattr(model, name) for name in model.serialize_fields] + [model.favorites_count]
+    stmt = select(*columns).order_by(model.favorites_count.desc(), model.id.desc()).limit(limit)
+    return [row._asdict() for row in db.session.execute(stmt)]
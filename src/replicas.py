@@ -0,0 +1,143 @@
+"""
+Read replicas. When replica urls are configured, GET and HEAD requests read from a replica
+(round robin over the healthy ones) and everything else goes to the primary, as does any
+write or flush made while handling a read.
+
+DATABASE_REPLICA_URLS     comma separated replica urls (default none: all traffic on the primary)
+REPLICA_STICKY_SECONDS    after a successful write, the same client reads from the primary this
+                          long so it sees its own writes despite replication lag (default 5)
+REPLICA_RETRY_SECONDS     a replica that can not be reached is left out this long and its reads
+                          go to the primary (default 30)
+
+Stickiness is carried by a cookie, so it covers clients that keep cookies. Clients within
+their sticky window bypass the response cache of cache.py, and pages read from a replica
+are not cached for REPLICA_STICKY_SECONDS after a write to their namespace, so a page read
+before the replica caught up is not served as the new generation.
+"""
+import itertools
+import math
+import os
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError
+from db_config import configure_engine, engine_options, pool_status
+
+STICKY_COOKIE = "read_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+
+def replica_urls():
+    urls = os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+    return [url.strip().replace("postgres://", "postgresql://") for url in urls if url.strip()]
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.down_until = 0.0
+        self.failures = 0
+
+    @property
+    def up(self):
+        return self.down_until <= time.monotonic()
+
+
+class ReplicaSet:
+    def __init__(self, engines, retry_seconds, sticky_seconds=0):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.retry_seconds = retry_seconds
+        self.sticky_seconds = sticky_seconds
+        self.counter = itertools.count()
+        for replica in self.replicas:
+            # async engines report errors on their sync engine
+            sync_engine = getattr(replica.engine, "sync_engine", replica.engine)
+            event.listen(sync_engine, "handle_error", self.error_listener(replica))
+
+    def error_listener(self, replica):
+        def handle_error(context):
+            # a failed connect or a dropped connection, not an error in the statement
+            if context.connection is None or context.is_disconnect:
+                replica.down_until = time.monotonic() + self.retry_seconds
+                replica.failures += 1
+        return handle_error
+
+    def pick(self):
+        healthy = [replica for replica in self.replicas if replica.up]
+        if not healthy:
+            return None
+        return healthy[next(self.counter) % len(healthy)]
+
+    def status(self):
+        return [{
+            "url": replica.engine.url.render_as_string(hide_password=True),
+            "up": replica.up,
+            "failures": replica.failures,
+            **pool_status(getattr(replica.engine, "sync_engine", replica.engine)),
+        } for replica in self.replicas]
+
+
+def reads_primary():
+    """True while the client is within REPLICA_STICKY_SECONDS of its last write."""
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def reads_replica():
+    """True while the current request reads from a replica."""
+    return has_request_context() and g.get("replica") is not None
+
+
+class RoutingSession(Session):
+    """Session that sends the reads of a request to the replica picked for it, see setup_replicas."""
+
+    def replica(self):
+        return g.get("replica") if has_request_context() else None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.replica()
+        if bind is None and replica is not None and not self._flushing and not getattr(clause, "is_dml", False):
+            return replica.engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        replica = self.replica()
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except DBAPIError:
+            if replica is None or replica.up:
+                raise
+            # the replica just became unreachable: the rest of the request reads from the primary
+            g.replica = None
+            self.rollback()
+            return super().execute(statement, *args, **kwargs)
+
+
+def setup_replicas(app):
+    urls = replica_urls()
+    if urls:
+        engines = [create_engine(url, **engine_options(url)) for url in urls]
+        for engine in engines:
+            configure_engine(engine)
+        app.extensions["replicas"] = ReplicaSet(engines, float(os.environ.get("REPLICA_RETRY_SECONDS", 30)),
+                                                float(os.environ.get("REPLICA_STICKY_SECONDS", 5)))
+
+    # the replica set is looked up per request: without one, everything stays on the primary
+    @app.before_request
+    def route_reads():
+        replicas = app.extensions.get("replicas")
+        if replicas is not None and request.method in READ_METHODS and not reads_primary():
+            g.replica = replicas.pick()
+
+    @app.after_request
+    def stick_to_primary(response):
+        replicas = app.extensions.get("replicas")
+        if replicas is None or replicas.sticky_seconds <= 0:
+            return response
+        if request.method not in READ_METHODS + ("OPTIONS",) and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, f"{time.time() + replicas.sticky_seconds:.3f}",
+                                max_age=math.ceil(replicas.sticky_seconds), httponly=True, samesite="Lax")
+        return response
@@ -1,3 +1,4 @@
+import threading
 from flask import jsonify, url_for
 
 class APIException(Exception):
@@ -20,8 +21,11 @@ def has_no_empty_params(rule):
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
-def generate_sitemap(app):
-    links = ['/admin/']
+def generate_sitemap(app, admin=True):
+    # the url map can not change once requests are served, so the page is built once
+    if "sitemap" in app.extensions:
+        return app.extensions["sitemap"]
+    links = ['/admin/'] if admin else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -31,7 +35,7 @@ def generate_sitemap(app):
                 links.append(url)
 
     links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in links])
-    return """
+    app.extensions["sitemap"] = """
         <div style="text-align: center;">
         <img style="max-height: 80px" src='https://storage.googleapis.com/breathecode/boilerplates/rigo-baby.jpeg' />
         <h1>Rigo welcomes you to your API!!</h1>
@@ -39,3 +43,28 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+    return app.extensions["sitemap"]
+
+
+class LazyMount:
+    """
+    WSGI middleware that hands the requests under prefix to a second application, built by
+    factory on the first of them, and everything else to wsgi_app.
+    """
+
+    def __init__(self, wsgi_app, prefix, factory):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.factory = factory
+        self.mounted = None
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path != self.prefix and not path.startswith(self.prefix + "/"):
+            return self.wsgi_app(environ, start_response)
+        if self.mounted is None:
+            with self.lock:
+                if self.mounted is None:
+                    self.mounted = self.factory()
+        return self.mounted(environ, start_response)
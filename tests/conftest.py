@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# set before the app is imported: a throwaway SQLite file, and no caches so that every
+# request reaches the database
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["CACHE_TTL"] = "0"
+os.environ["IDENTITY_CACHE_TTL"] = "0"
+os.environ.pop("DATABASE_REPLICA_URLS", None)
+
+SEED_SIZE = 20
+FAVORITES_PER_USER = 3
+
+
+def seed(db):
+    from bulk import recount_favorites
+    from models import User, People, Planet, Vehicle, FavoritePeople, FavoritePlanet
+    for i in range(1, SEED_SIZE + 1):
+        db.session.add(User(id=i, email=f"user{i}@swapi.dev", password="x"))
+        db.session.add(People(id=i, name=f"person-{i}", gender=("female", "male")[i % 2], user_id=i))
+        db.session.add(Planet(id=i, name=f"planet-{i}", terrain=("ice", "rock")[i % 2], climate=("frozen", "arid")[i % 2]))
+        db.session.add(Vehicle(id=i, name=f"vehicle-{i}", model="x"))
+    db.session.flush()
+    for i in range(1, SEED_SIZE + 1):
+        for j in range(FAVORITES_PER_USER):
+            target = (i + j) % SEED_SIZE + 1
+            db.session.add(FavoritePeople(user_id=i, people_id=target))
+            db.session.add(FavoritePlanet(user_id=i, planet_id=target))
+    db.session.flush()
+    recount_favorites(FavoritePeople)
+    recount_favorites(FavoritePlanet)
+    db.session.commit()
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app
+    from models import db
+    with app.app_context():
+        db.create_all()
+        seed(db)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager collecting the statements sent to the database inside it."""
+    from models import db
+    with app.app_context():
+        engine = db.engine
+
+    @contextmanager
+    def counting():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+    return counting
@@ -0,0 +1,85 @@
+import time
+import pytest
+
+
+class FakeRedis:
+    """Local stand-in for a redis client: get, set(key, value, ex=) and incr, values as bytes."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.values[key] = (str(value).encode(), time.monotonic() + ex if ex else None)
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.values[key] = (str(value).encode(), None)
+        return value
+
+
+@pytest.fixture(params=["memory", "client"])
+def response_cache(app, request):
+    """Turns the response cache on for the test, in process or through a redis-like client."""
+    from cache import ClientBackend, MemoryBackend, ResponseCache
+    backend = MemoryBackend() if request.param == "memory" else ClientBackend(FakeRedis())
+    previous = app.extensions["response_cache"]
+    app.extensions["response_cache"] = ResponseCache(backend, ttl=60)
+    yield app.extensions["response_cache"]
+    app.extensions["response_cache"] = previous
+
+
+def test_hits_skip_the_database(client, count_queries, response_cache):
+    first = client.get("/vehicles?limit=5")
+    with count_queries() as statements:
+        second = client.get("/vehicles?limit=5")
+    assert second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert statements == []
+
+
+def test_writes_invalidate(client, count_queries, response_cache):
+    assert client.get("/vehicles/2").status_code == 200
+    model = f"model-{time.monotonic_ns()}"
+    assert client.put("/vehicles/2", json={"model": model}).status_code == 200
+    with count_queries() as statements:
+        response = client.get("/vehicles/2")
+    assert response.get_json()["model"] == model
+    assert statements
+
+
+def test_failed_writes_keep_the_cache(client, count_queries, response_cache):
+    client.get("/vehicles/3")
+    assert client.put("/vehicles/3", json={"model": 3}).status_code == 400
+    with count_queries() as statements:
+        client.get("/vehicles/3")
+    assert statements == []
+
+
+def test_if_none_match(client, count_queries, response_cache):
+    etag = client.get("/planets?limit=5").headers["ETag"]
+    with count_queries() as statements:
+        response = client.get("/planets?limit=5", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert statements == []
+    assert client.get("/planets?limit=5", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_client_backend_keys():
+    from cache import ClientBackend
+    redis = FakeRedis()
+    backend = ClientBackend(redis, prefix="test")
+    backend.set("page", "body", 60)
+    assert backend.get("page") == "body"
+    assert redis.get("test:page") == b"body"
+    assert backend.get_counter("generation:planets") == 0
+    assert backend.incr("generation:planets") == 1
+    assert backend.get_counter("generation:planets") == 1
+    assert backend.get("missing") is None
@@ -0,0 +1,29 @@
+from sqlalchemy import inspect
+
+
+def index_names(app, table):
+    from models import db
+    with app.app_context():
+        inspector = inspect(db.engine)
+        return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def row_count(client, path):
+    return len(client.get(f"{path}?limit=100").get_json())
+
+
+def test_failed_import_keeps_indexes(app, client, tmp_path):
+    before = index_names(app, "planets")
+    rows = row_count(client, "/planets")
+    path = tmp_path / "planets.csv"
+    # the second row has no climate, which is NOT NULL
+    path.write_text("name,terrain,climate\nimported-1,ice,frozen\nimported-2,ice,\n")
+
+    # the flask command pushes the app context, the test runner does not
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=["data", "import", "planets", str(path)])
+
+    assert result.exit_code != 0
+    assert "nothing was imported" in result.output
+    assert before and index_names(app, "planets") == before
+    assert row_count(client, "/planets") == rows
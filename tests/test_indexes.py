@@ -0,0 +1,44 @@
+import pytest
+
+# query string -> index SQLite must use for it. The name prefix is a range on the index of
+# the unique constraint (the text_pattern_ops index is Postgres only).
+PLANS = [
+    ("People", "gender=female", "ix_peoples_gender_id"),
+    ("Planet", "terrain=ice", "ix_planets_terrain_id"),
+    ("Planet", "climate=arid", "ix_planets_climate_id"),
+    ("Planet", "terrain=ice&climate=arid", "ix_planets_"),
+    ("People", "name=person-1", "sqlite_autoindex_peoples_1"),
+    ("Planet", "name=planet-1", "sqlite_autoindex_planets_1"),
+    ("People", "order_by=gender", "ix_peoples_gender_id"),
+    ("People", "order_by=-name", "sqlite_autoindex_peoples_1"),
+    ("Planet", "order_by=climate", "ix_planets_climate_id"),
+    ("Planet", "terrain=ice&order_by=-terrain", "ix_planets_terrain_id"),
+]
+
+
+def query_plan(app, model, query_string):
+    import models
+    from queries import page_query
+    with app.test_request_context(f"/?{query_string}"):
+        stmt, _, _ = page_query(getattr(models, model))
+        engine = models.db.engine
+        sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+        with engine.connect() as connection:
+            return [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+@pytest.mark.parametrize("model, query_string, index", PLANS)
+def test_listing_uses_index(app, model, query_string, index):
+    plan = query_plan(app, model, query_string)
+    assert any(f"USING INDEX {index}" in step or f"USING COVERING INDEX {index}" in step for step in plan), plan
+
+
+@pytest.mark.parametrize("model, query_string", [
+    ("People", "order_by=gender"),
+    ("People", "order_by=-name"),
+    ("Planet", "order_by=climate"),
+    ("Planet", "terrain=ice&order_by=-terrain"),
+])
+def test_ordering_needs_no_sort(app, model, query_string):
+    plan = query_plan(app, model, query_string)
+    assert not any("TEMP B-TREE" in step for step in plan), plan
@@ -0,0 +1,71 @@
+import json
+import pytest
+
+# statements per request, whatever the number of rows on the page
+LIST_QUERY_BOUNDS = {
+    "/users": 2,  # the page, then the people of the whole page in one IN query
+    "/people": 1,
+    "/planets": 1,
+    "/vehicles": 1,
+    "/users/1/favorites": 1,
+    "/people?gender=female&order_by=-name": 1,
+    "/users?fields=email": 1,
+}
+
+
+@pytest.mark.parametrize("path, bound", LIST_QUERY_BOUNDS.items())
+def test_list_query_count(client, count_queries, path, bound):
+    with count_queries() as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert response.get_json()
+    assert len(statements) <= bound, statements
+
+
+@pytest.mark.parametrize("path, bound", [("/users?limit=5", 2), ("/people?limit=5", 1)])
+def test_next_page_query_count(client, count_queries, path, bound):
+    cursor = client.get(path).headers["X-Next-Cursor"]
+    with count_queries() as statements:
+        response = client.get(f"{path}&after={cursor}")
+    assert response.status_code == 200
+    assert len(response.get_json()) == 5
+    assert len(statements) <= bound, statements
+
+
+@pytest.mark.parametrize("prefix, upper", [
+    ("ab", "ac"),
+    ("a\ud7ff", "a\ue000"),
+    ("a\U0010ffff", "b"),
+    ("\U0010ffff\U0010ffff", None),
+])
+def test_prefix_upper_bound(app, prefix, upper):
+    from queries import prefix_upper_bound
+    assert prefix_upper_bound(prefix) == upper
+
+
+@pytest.mark.parametrize("prefix", ["planet-1", "planet\U0010ffff", "\U0010ffff", "plane\ud7ff"])
+def test_prefix_filter_edge_characters(client, prefix):
+    response = client.get("/planets", query_string={"name": prefix})
+    assert response.status_code == 200
+    assert all(planet["name"].startswith(prefix) for planet in response.get_json())
+
+
+@pytest.mark.parametrize("key", ['{"id":99999999999999999999}', '{"id":-99999999999999999999}', '{"id":true}'])
+def test_cursor_out_of_range(client, key):
+    from queries import encode_cursor
+    response = client.get("/planets", query_string={"after": encode_cursor(json.loads(key))})
+    assert response.status_code == 400
+
+
+def test_fields_leave_out_the_order_column(client):
+    response = client.get("/people?fields=name&order_by=gender&limit=5")
+    assert [set(item) for item in response.get_json()] == [{"id", "name"}] * 5
+    cursor = response.headers["X-Next-Cursor"]
+    following = client.get(f"/people?fields=name&order_by=gender&limit=5&after={cursor}").get_json()
+    assert set(following[0]) == {"id", "name"}
+    assert not {item["id"] for item in following} & {item["id"] for item in response.get_json()}
+
+
+@pytest.mark.parametrize("ids, status", [("1,2", 200), ("99999999999999999999", 400), ("1,x", 400)])
+def test_ids_parameter(client, ids, status):
+    assert client.get("/planets", query_string={"ids": ids}).status_code == status
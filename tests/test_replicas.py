@@ -0,0 +1,94 @@
+import time
+import pytest
+from sqlalchemy import create_engine
+
+STICKY_SECONDS = 60
+
+
+@pytest.fixture
+def replica_url(tmp_path):
+    """A replica in its own SQLite file, holding a single planet that the primary does not
+    have, so responses show where they were read."""
+    from models import db, Planet
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Planet.__table__.insert(), {"id": 1000, "name": "replica-only", "terrain": "ice", "climate": "frozen"})
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def install_replica(app):
+    """Routes the reads of the app to a replica at the given url for the test."""
+    from db_config import configure_engine
+    from replicas import ReplicaSet
+    response_cache = app.extensions["response_cache"]
+
+    def install(url):
+        engine = create_engine(url)
+        configure_engine(engine)
+        app.extensions["replicas"] = ReplicaSet([engine], retry_seconds=30, sticky_seconds=STICKY_SECONDS)
+        return app.extensions["replicas"]
+    yield install
+    replicas = app.extensions.pop("replicas", None)
+    if replicas is not None:
+        for replica in replicas.replicas:
+            replica.engine.dispose()
+    app.extensions["response_cache"] = response_cache
+
+
+def planet_names(response):
+    assert response.status_code == 200
+    return {planet["name"] for planet in response.get_json()}
+
+
+def test_reads_go_to_the_replica(app, replica_url, install_replica):
+    install_replica(replica_url)
+    client = app.test_client()
+    assert planet_names(client.get("/planets")) == {"replica-only"}
+    assert client.get("/planets/1000").status_code == 200
+    assert client.get_cookie("read_primary_until") is None
+
+
+def test_reads_stick_to_the_primary_after_a_write(app, replica_url, install_replica):
+    install_replica(replica_url)
+    client = app.test_client()
+    response = client.put("/vehicles/1", json={"model": "x"})
+    assert response.status_code == 200
+
+    cookie = client.get_cookie("read_primary_until")
+    assert cookie is not None and float(cookie.value) > time.time() + STICKY_SECONDS - 5
+    assert client.get("/planets/1000").status_code == 404
+    assert "planet-1" in planet_names(client.get("/planets"))
+    # other clients still read from the replica
+    assert planet_names(app.test_client().get("/planets")) == {"replica-only"}
+
+
+def test_unreachable_replica_falls_back_to_the_primary(app, install_replica, tmp_path):
+    replicas = install_replica(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    client = app.test_client()
+    assert "planet-1" in planet_names(client.get("/planets"))
+    replica = replicas.replicas[0]
+    assert not replica.up and replica.failures == 1
+    # left out until REPLICA_RETRY_SECONDS pass, without trying it again
+    assert "planet-1" in planet_names(client.get("/planets"))
+    assert replica.failures == 1
+
+
+def test_sticky_clients_bypass_the_response_cache(app, replica_url, install_replica):
+    from cache import MemoryBackend, ResponseCache
+    install_replica(replica_url)
+    backend = MemoryBackend()
+    app.extensions["response_cache"] = ResponseCache(backend, ttl=60, settle_seconds=STICKY_SECONDS)
+    # another client caches the replica's page
+    assert planet_names(app.test_client().get("/planets")) == {"replica-only"}
+    planets_key, = [key for key in backend.entries if key.startswith("planets.")]
+
+    client = app.test_client()
+    # a write that does not touch the planets keeps their cached page
+    assert client.put("/vehicles/1", json={"model": "x"}).status_code == 200
+    assert "planet-1" in planet_names(client.get("/planets"))
+    assert planet_names(app.test_client().get("/planets")) == {"replica-only"}
+    assert [key for key in backend.entries if key.startswith("planets.")] == [planets_key]